@@ -0,0 +1,199 @@
+import json
+import math
+from typing import Dict, List, Optional
+
+from .exceptions import RemoteDockerException
+
+HOURS_PER_MONTH = 730
+GIB = 1024**3
+
+# Utilization the recommended instance should run at, at the 95th percentile
+TARGET_CPU_PERCENT = 70.0
+TARGET_MEM_PERCENT = 80.0
+TARGET_DISK_PERCENT = 60.0
+DISK_FULL_PERCENT = 80.0
+GPU_IDLE_PERCENT = 5.0
+IOWAIT_PERCENT = 10.0
+SWAP_PRESSURE_PERCENT = 5.0
+
+# On-demand linux prices in us-east-1 (USD/hour), other regions differ slightly
+INSTANCE_CATALOG = {
+    "t3.medium": dict(vcpus=2, mem_gib=4, gpus=0, hourly=0.0416),
+    "t3.large": dict(vcpus=2, mem_gib=8, gpus=0, hourly=0.0832),
+    "t3.xlarge": dict(vcpus=4, mem_gib=16, gpus=0, hourly=0.1664),
+    "t3.2xlarge": dict(vcpus=8, mem_gib=32, gpus=0, hourly=0.3328),
+    "c5.large": dict(vcpus=2, mem_gib=4, gpus=0, hourly=0.085),
+    "c5.xlarge": dict(vcpus=4, mem_gib=8, gpus=0, hourly=0.17),
+    "c5.2xlarge": dict(vcpus=8, mem_gib=16, gpus=0, hourly=0.34),
+    "c5.4xlarge": dict(vcpus=16, mem_gib=32, gpus=0, hourly=0.68),
+    "m5.large": dict(vcpus=2, mem_gib=8, gpus=0, hourly=0.096),
+    "m5.xlarge": dict(vcpus=4, mem_gib=16, gpus=0, hourly=0.192),
+    "m5.2xlarge": dict(vcpus=8, mem_gib=32, gpus=0, hourly=0.384),
+    "m5.4xlarge": dict(vcpus=16, mem_gib=64, gpus=0, hourly=0.768),
+    "r5.large": dict(vcpus=2, mem_gib=16, gpus=0, hourly=0.126),
+    "r5.xlarge": dict(vcpus=4, mem_gib=32, gpus=0, hourly=0.252),
+    "r5.2xlarge": dict(vcpus=8, mem_gib=64, gpus=0, hourly=0.504),
+    "g4dn.xlarge": dict(vcpus=4, mem_gib=16, gpus=1, hourly=0.526),
+    "g4dn.2xlarge": dict(vcpus=8, mem_gib=32, gpus=1, hourly=0.752),
+    "g4dn.4xlarge": dict(vcpus=16, mem_gib=64, gpus=1, hourly=1.204),
+    "g5.xlarge": dict(vcpus=4, mem_gib=16, gpus=1, hourly=1.006),
+    "g5.2xlarge": dict(vcpus=8, mem_gib=32, gpus=1, hourly=1.212),
+}
+# gp2 storage, USD per GB-month
+VOLUME_MONTHLY_PER_GIB = 0.10
+
+
+def load_samples(path: str, *, window_hours: Optional[float] = None) -> List[Dict]:
+    """
+    Read the samples recorded by `perry top --record`, keeping only the
+    last `window_hours` before the most recent sample
+    """
+    with open(path) as fh:
+        samples = [json.loads(line) for line in fh if line.strip()]
+
+    if not samples:
+        raise RemoteDockerException(f"No samples recorded in {path}")
+
+    if window_hours is not None:
+        end = max(sample["timestamp"] for sample in samples)
+        start = end - window_hours * 3600
+        samples = [sample for sample in samples if sample["timestamp"] >= start]
+
+    return sorted(samples, key=lambda sample: sample["timestamp"])
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(samples: List[Dict]) -> Dict:
+    latest = samples[-1]
+    gpu_utilization = [
+        max(gpu["utilization_percent"] for gpu in sample["gpus"])
+        for sample in samples
+        if sample["gpus"]
+    ]
+    return dict(
+        samples=len(samples),
+        hours=(latest["timestamp"] - samples[0]["timestamp"]) / 3600,
+        vcpus=latest["vcpus"],
+        mem_gib=latest["mem_total"] / GIB,
+        has_gpu=bool(latest["gpus"]),
+        cpu_p95=percentile([s["cpu_percent"] for s in samples], 95),
+        cpu_mean=sum(s["cpu_percent"] for s in samples) / len(samples),
+        iowait_mean=sum(s["iowait_percent"] for s in samples) / len(samples),
+        mem_p95=percentile([s["mem_used_percent"] for s in samples], 95),
+        swap_max=max(s["swap_used_percent"] for s in samples),
+        gpu_p95=percentile(gpu_utilization, 95),
+        disk_size_gib=latest["disk_size"] / GIB,
+        disk_used_gib=max(s["disk_used"] for s in samples) / GIB,
+    )
+
+
+class Recommendation:
+    def __init__(
+        self,
+        *,
+        summary: Dict,
+        current_type: str,
+        current_volume_size: int,
+        instance_type: str,
+        volume_size: int,
+        notes: List[str],
+    ):
+        self.summary = summary
+        self.current_type = current_type
+        self.current_volume_size = current_volume_size
+        self.instance_type = instance_type
+        self.volume_size = volume_size
+        self.notes = notes
+
+    @property
+    def changes_instance_type(self) -> bool:
+        return self.instance_type != self.current_type
+
+    @property
+    def changes_volume_size(self) -> bool:
+        return self.volume_size != self.current_volume_size
+
+    def projected_cpu_p95(self) -> Optional[float]:
+        if self.instance_type not in INSTANCE_CATALOG:
+            return None
+        vcpus = INSTANCE_CATALOG[self.instance_type]["vcpus"]
+        return self.summary["cpu_p95"] * self.summary["vcpus"] / vcpus
+
+    def projected_mem_p95(self) -> Optional[float]:
+        if self.instance_type not in INSTANCE_CATALOG:
+            return None
+        mem_gib = INSTANCE_CATALOG[self.instance_type]["mem_gib"]
+        return self.summary["mem_p95"] * self.summary["mem_gib"] / mem_gib
+
+    def monthly_cost(self, instance_type: str, volume_size: int) -> Optional[float]:
+        if instance_type not in INSTANCE_CATALOG:
+            return None
+        return (
+            INSTANCE_CATALOG[instance_type]["hourly"] * HOURS_PER_MONTH
+            + volume_size * VOLUME_MONTHLY_PER_GIB
+        )
+
+
+def recommend(
+    summary: Dict, *, current_type: str, current_volume_size: int
+) -> Recommendation:
+    notes = []
+
+    needed_vcpus = summary["vcpus"] * summary["cpu_p95"] / TARGET_CPU_PERCENT
+    needed_mem_gib = summary["mem_gib"] * summary["mem_p95"] / TARGET_MEM_PERCENT
+    if summary["swap_max"] >= SWAP_PRESSURE_PERCENT:
+        notes.append(
+            f"swap reached {summary['swap_max']:.0f}%, memory is under pressure"
+        )
+        needed_mem_gib *= 1.25
+
+    needs_gpu = summary["has_gpu"] and summary["gpu_p95"] >= GPU_IDLE_PERCENT
+    if summary["has_gpu"] and not needs_gpu:
+        notes.append(
+            f"the GPU stayed below {GPU_IDLE_PERCENT:.0f}% utilization (p95),"
+            " a non-GPU instance would do"
+        )
+
+    candidates = [
+        (spec["hourly"], name)
+        for name, spec in INSTANCE_CATALOG.items()
+        if spec["vcpus"] >= needed_vcpus
+        and spec["mem_gib"] >= needed_mem_gib
+        and bool(spec["gpus"]) == needs_gpu
+    ]
+    if candidates:
+        cheapest_hourly, instance_type = min(candidates)
+        # prefer not to churn the instance when the current type is as cheap
+        if (cheapest_hourly, current_type) in candidates:
+            instance_type = current_type
+    else:
+        notes.append("no known instance type fits the recorded load")
+        instance_type = current_type
+
+    volume_size = current_volume_size
+    disk_used_percent = 100 * summary["disk_used_gib"] / summary["disk_size_gib"]
+    if disk_used_percent >= DISK_FULL_PERCENT:
+        volume_size = math.ceil(100 * summary["disk_used_gib"] / TARGET_DISK_PERCENT)
+        notes.append(f"the volume reached {disk_used_percent:.0f}% usage")
+
+    if summary["iowait_mean"] >= IOWAIT_PERCENT:
+        notes.append(
+            f"mean iowait is {summary['iowait_mean']:.0f}%, gp2 volumes get 3 IOPS"
+            " per GB so a larger volume also gives more IO throughput"
+        )
+
+    return Recommendation(
+        summary=summary,
+        current_type=current_type,
+        current_volume_size=current_volume_size,
+        instance_type=instance_type,
+        volume_size=volume_size,
+        notes=notes,
+    )
@@ -6,11 +6,22 @@ import os
 from pydantic import BaseModel
 import platform
 
+from .exceptions import RemoteDockerException
+
 KEY_PAIR_NAME = "perry-keypair"
 INSTANCE_SERVICE_NAME = "perry-ec2-agent"
 SCEPTRE_PROJECT_CODE = "perry"
 
 
+class AgentConfig(BaseModel):
+    # --- overrides of the project wide properties for one agent of the fleet
+    instance_type: Optional[str]
+    volume_size: Optional[int]
+    instance_ami: Optional[str]
+    local_port_forwards: Optional[Dict[str, Dict[str, str]]]
+    remote_port_forwards: Optional[Dict[str, Dict[str, str]]]
+
+
 class PerryConfig(BaseModel):
     # --- aws properties
     aws_region: str = "us-east-1"
@@ -35,7 +46,21 @@ class PerryConfig(BaseModel):
     ignore_dirs: List[str] = []
     local_port_forwards: Dict[str, Dict[str, str]] = {}
     remote_port_forwards: Dict[str, Dict[str, str]] = {}
+    # forward published container ports as containers start and stop
+    dynamic_port_forwards: bool = False
     sync_paths: List[Path]
+    # remote paths that are indexed but only pulled on `perry fetch`
+    lazy_paths: List[Path] = []
+    # paths pushed ahead of the rest of a pending sync
+    hot_paths: List[Path] = []
+    sync_recent_window: int = 600
+    sync_small_file_size: int = 1024 * 1024
+    sync_priority_batch_size: int = 200
+
+    # --- fleet properties
+    agents: Dict[str, AgentConfig] = {}
+    agent_name: Optional[str]
+    fleet_max_workers: int = 4
 
     # --- instance properties
     instance_type: str = "t3.medium"
@@ -59,7 +84,6 @@ class PerryConfig(BaseModel):
         && sudo service sshd restart
         && wget -qO- https://github.com/bcpierce00/unison/releases/download/v2.52.1/unison-v2.52.1+ocaml-4.01.0+x86_64.linux.tar.gz | tar -xvz
         && sudo mv bin/* /usr/local/bin/
-        && sudo reboot
     """
     # Looked up via https://cloud-images.ubuntu.com/locator/ec2/
     # With filters:
@@ -96,9 +120,48 @@ class PerryConfig(BaseModel):
         value = f"{env_label}{self.env_label_suffix}{self.separator}{value}"
         return value
 
+    def _agent_suffix(self, value: str) -> str:
+        if self.agent_name is None:
+            return value
+        return f"{value}{self.separator}{self.agent_name}"
+
+    def for_agent(self, agent_name: str) -> "PerryConfig":
+        if agent_name not in self.agents:
+            raise RemoteDockerException(
+                f"No agent named {agent_name}, expected one of {list(self.agents)}"
+            )
+        overrides = {
+            key: value
+            for key, value in self.agents[agent_name].dict().items()
+            if value is not None
+        }
+        # The tunnels of several agents run side by side, so an agent only
+        # binds the local ports it lists itself
+        overrides.setdefault("local_port_forwards", {})
+        return self.copy(update=dict(agent_name=agent_name, agents={}, **overrides))
+
+    @property
+    def agent_configs(self) -> Dict[str, "PerryConfig"]:
+        agent_configs = {
+            agent_name: self.for_agent(agent_name) for agent_name in self.agents
+        }
+
+        port_owners = {}
+        for agent_name, agent_config in agent_configs.items():
+            for port_mappings in agent_config.local_port_forwards.values():
+                for port in port_mappings:
+                    if port in port_owners:
+                        raise RemoteDockerException(
+                            f"Local port {port} is forwarded by both the"
+                            f" {port_owners[port]} and {agent_name} agents"
+                        )
+                    port_owners[port] = agent_name
+
+        return agent_configs
+
     @property
     def instance_service_name(self) -> str:
-        return self._prefix(INSTANCE_SERVICE_NAME)
+        return self._agent_suffix(self._prefix(INSTANCE_SERVICE_NAME))
 
     @property
     def key_pair_name(self) -> str:
@@ -109,7 +172,9 @@ class PerryConfig(BaseModel):
         if self.key_path is not None:
             return str(Path(os.path.expanduser(self.key_path)))
         else:
-            under_score_project_code = self.project_code.replace("-", "_")
+            # agents of a fleet share the project's key
+            project_code = self._prefix(SCEPTRE_PROJECT_CODE)
+            under_score_project_code = project_code.replace("-", "_")
             key_path = str(
                 Path(os.path.expanduser(f"~/.ssh/id_rsa_{under_score_project_code}"))
             )
@@ -119,21 +184,32 @@ class PerryConfig(BaseModel):
 
     @property
     def project_code(self) -> str:
-        return self._prefix(SCEPTRE_PROJECT_CODE)
+        return self._agent_suffix(self._prefix(SCEPTRE_PROJECT_CODE))
 
     @property
     def expanded_sync_dir(self) -> str:
         return os.path.expanduser("~")
 
-    @property
-    def expanded_sync_paths(self) -> List[str]:
+    def _relative_to_sync_dir(self, paths: List[Path]) -> List[str]:
         return [
             str(Path(os.path.expanduser(f)).absolute()).split(
                 self.expanded_sync_dir + os.sep
             )[1]
-            for f in self.sync_paths
+            for f in paths
         ]
 
+    @property
+    def expanded_sync_paths(self) -> List[str]:
+        return self._relative_to_sync_dir(self.sync_paths)
+
+    @property
+    def expanded_lazy_paths(self) -> List[str]:
+        return self._relative_to_sync_dir(self.lazy_paths)
+
+    @property
+    def expanded_hot_paths(self) -> List[str]:
+        return self._relative_to_sync_dir(self.hot_paths)
+
     @property
     def system_env_label(self) -> str:
         if self.env_label is not None:
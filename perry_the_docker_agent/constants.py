@@ -3,4 +3,7 @@ import pathlib
 
 # linux username of instance
 
-SCEPTRE_PATH = os.path.join(pathlib.Path(__file__).parent.absolute(), "sceptre")
\ No newline at end of file
+SCEPTRE_PATH = os.path.join(pathlib.Path(__file__).parent.absolute(), "sceptre")
+
+# local state kept between invocations (eg: the port forward registry)
+PERRY_STATE_DIR = os.path.join(os.path.expanduser("~"), ".perry")
@@ -1,12 +1,40 @@
+import json
 import os
 import shlex
 import subprocess
+import time
 from getpass import getuser
-from typing import Dict, List
+from typing import Callable, Dict, Iterator, List, Optional
 
 from .config import PerryConfig
+from .constants import PERRY_STATE_DIR
+from .exceptions import RemoteDockerException
+from .port_forwarding import DockerEventPortForwarder, PortForwardRegistry
 from .providers import AWSInstanceProvider, InstanceProvider
-from .util import logger
+from .sync_queue import (
+    TIER_RECENT,
+    SyncQueue,
+    load_manifest,
+    save_manifest,
+    scan_sync_paths,
+)
+from .telemetry import TelemetrySampler, get_sampler_script, parse_frames
+from .util import keep_sudo_alive, logger
+
+LAZY_INDEX_FILENAME = ".perry-index.json"
+
+# Starts a child process, letting a supervisor (eg: `perry up`) keep its handle
+Popen = Callable[[List[str]], subprocess.Popen]
+
+
+def _run_child(cmd: List[str], popen: Optional[Popen] = None):
+    if popen is None:
+        subprocess.run(cmd, check=True)
+        return
+
+    returncode = popen(cmd).wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
 
 
 class RemoteDockerClient:
@@ -16,9 +44,15 @@ class RemoteDockerClient:
         instance: InstanceProvider,
         local_port_forwards: Dict[str, Dict[str, str]],
         remote_port_forwards: Dict[str, Dict[str, str]],
+        dynamic_port_forwards: bool,
         ssh_key_path: str,
         sync_dir: str,
         sync_paths: List[str],
+        lazy_paths: List[str],
+        hot_paths: List[str],
+        sync_recent_window: int,
+        sync_small_file_size: int,
+        sync_priority_batch_size: int,
         ignore_dirs: str,
         project_code: str,
         bind_address: str,
@@ -26,9 +60,15 @@ class RemoteDockerClient:
         self.instance = instance
         self.local_port_forwards = local_port_forwards
         self.remote_port_forwards = remote_port_forwards
+        self.dynamic_port_forwards = dynamic_port_forwards
         self.ssh_key_path = ssh_key_path
         self.sync_dir = sync_dir
         self.sync_paths = sync_paths
+        self.lazy_paths = lazy_paths
+        self.hot_paths = hot_paths
+        self.sync_recent_window = sync_recent_window
+        self.sync_small_file_size = sync_small_file_size
+        self.sync_priority_batch_size = sync_priority_batch_size
         self.ignore_dirs = ignore_dirs
         self.project_code = project_code
         self.bind_address = bind_address
@@ -52,14 +92,23 @@ class RemoteDockerClient:
             instance=instance,
             local_port_forwards=config.local_port_forwards,
             remote_port_forwards=config.remote_port_forwards,
+            dynamic_port_forwards=config.dynamic_port_forwards,
             ssh_key_path=config.non_null_key_path,
             sync_dir=config.expanded_sync_dir,
             sync_paths=config.expanded_sync_paths,
+            lazy_paths=config.expanded_lazy_paths,
+            hot_paths=config.expanded_hot_paths,
+            sync_recent_window=config.sync_recent_window,
+            sync_small_file_size=config.sync_small_file_size,
+            sync_priority_batch_size=config.sync_priority_batch_size,
             ignore_dirs=config.ignore_dirs,
             project_code=config.project_code,
             bind_address=config.bind_address
         )
 
+    def get_instance_state(self) -> str:
+        return self.instance.get_instance_state()
+
     def get_ip(self) -> str:
         logger.debug("Retrieving IP address of instance")
         return self.instance.get_ip()
@@ -83,9 +132,7 @@ class RemoteDockerClient:
     def is_termination_protection_enabled(self) -> bool:
         return self.instance.is_termination_protection_enabled()
 
-    def start_tunnel(self):
-
-        ip = self.instance.get_ip()
+    def _get_tunnel_cmd(self, *, ip: str, control_path: str = None) -> List[str]:
         cmd_s = (
             "sudo ssh -v -o ExitOnForwardFailure=yes -o StrictHostKeyChecking=no"
             " -o ServerAliveInterval=60 -N -T"
@@ -100,6 +147,9 @@ class RemoteDockerClient:
             f" -o LocalCommand='sudo chown {getuser()} {target_sock}'"
         )
 
+        if control_path is not None:
+            cmd_s += f" -M -S {control_path}"
+
         for _name, port_mappings in self.local_port_forwards.items():
             for port_from, port_to in port_mappings.items():
                 cmd_s += f" -L {self.bind_address}:{port_from}:localhost:{port_to}"
@@ -108,19 +158,85 @@ class RemoteDockerClient:
             for port_from, port_to in port_mappings.items():
                 cmd_s += f" -R 0.0.0.0:{port_from}:localhost:{port_to}"
 
-        logger.info("Starting tunnel")
-        cmd = shlex.split(cmd_s)
         logger.debug("Running command: %s", cmd_s)
+        return shlex.split(cmd_s)
+
+    @property
+    def _tunnel_control_path(self) -> str:
+        return f"/var/run/{self.project_code}.ctl"
+
+    @property
+    def port_forward_registry(self) -> PortForwardRegistry:
+        return PortForwardRegistry(
+            os.path.join(PERRY_STATE_DIR, f"{self.project_code}-forwards.json")
+        )
+
+    def start_tunnel(self, *, ip: str = None, popen: Optional[Popen] = None):
 
+        ip = ip or self.instance.get_ip()
+        control_path = (
+            self._tunnel_control_path if self.dynamic_port_forwards else None
+        )
+        cmd = self._get_tunnel_cmd(ip=ip, control_path=control_path)
+
+        logger.info("Starting tunnel")
         logger.debug("Forwarding: ")
         logger.debug("Local: %s", self.local_port_forwards)
         logger.debug("Remote: %s", self.remote_port_forwards)
-        subprocess.run(cmd, check=True)
+
+        if not self.dynamic_port_forwards:
+            _run_child(cmd, popen)
+            return
+
+        # A stale control socket would stop ssh from becoming the master
+        subprocess.run(["sudo", "rm", "-f", control_path], check=True)
+        tunnel = (popen or subprocess.Popen)(cmd)
+        try:
+            while not os.path.exists(control_path):
+                if tunnel.poll() is not None:
+                    raise subprocess.CalledProcessError(tunnel.returncode, cmd)
+                time.sleep(0.5)
+
+            # The master runs as root and only accepts root clients on its
+            # control socket, so the forwarder goes through sudo for as long as
+            # the tunnel is up; -n makes an expired cache fail rather than prompt
+            keep_sudo_alive(is_alive=lambda: tunnel.poll() is None)
+
+            logger.info("Forwarding published container ports as they start")
+            forwarder = DockerEventPortForwarder(
+                ssh_prefix=["sudo", "-n", "ssh", "-S", control_path],
+                host=f"{self.instance.username}@{ip}",
+                bind_address=self.bind_address,
+                static_ports={
+                    int(port_from)
+                    for port_mappings in self.local_port_forwards.values()
+                    for port_from in port_mappings
+                },
+                registry=self.port_forward_registry,
+            )
+            forwarder.run(is_alive=lambda: tunnel.poll() is None)
+
+            returncode = tunnel.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, cmd)
+        finally:
+            if tunnel.poll() is None:
+                tunnel.terminate()
 
     def create_instance(self):
         logger.info("Creating instance")
         return self.instance.create_instance(self.ssh_key_path)
 
+    def update_instance(self, *, instance_type: str, volume_size: int) -> Dict:
+        logger.warning(
+            "Updating instance to %s with a %sGB volume", instance_type, volume_size
+        )
+        return self.instance.update_instance(
+            instance_type=instance_type,
+            volume_size=volume_size,
+            ssh_key_path=self.ssh_key_path,
+        )
+
     def delete_instance(self) -> Dict:
         logger.warning("Deleting instance")
         return self.instance.delete_instance()
@@ -132,18 +248,37 @@ class RemoteDockerClient:
             options=options,
         )
 
-    def ssh_run(self, *, ssh_cmd: str):
+    def ssh_run(self, *, ssh_cmd: str, ip: str = None):
         return self.instance.ssh_run(
             ssh_key_path=self.ssh_key_path,
             ssh_cmd=ssh_cmd,
+            ip=ip,
+        )
+
+    def stream_telemetry(self, *, interval: int) -> Iterator[Dict]:
+        """
+        Sample host and container metrics every `interval` seconds over one
+        long-lived SSH session
+        """
+        process = self.instance.ssh_stream(
+            ssh_key_path=self.ssh_key_path, ssh_cmd="bash -s"
         )
+        process.stdin.write(get_sampler_script(interval))
+        process.stdin.close()
+
+        sampler = TelemetrySampler()
+        try:
+            for frame in parse_frames(process.stdout):
+                sample = sampler.sample(frame)
+                if sample is not None:
+                    yield sample
+        finally:
+            process.terminate()
 
     def create_keypair(self) -> Dict:
         return self.instance.create_keypair(self.ssh_key_path)
 
-    def use_remote_context(self):
-        logger.info(f"Switching docker context to {self.project_code}")
-
+    def create_remote_context(self):
         subprocess.run(
             (
                 f"docker context inspect {self.project_code} &>/dev/null || "
@@ -153,6 +288,11 @@ class RemoteDockerClient:
             check=True,
             shell=True,
         )
+
+    def use_remote_context(self):
+        logger.info(f"Switching docker context to {self.project_code}")
+
+        self.create_remote_context()
         subprocess.run(
             f"docker context use {self.project_code} >/dev/null",
             check=True,
@@ -172,30 +312,118 @@ class RemoteDockerClient:
         replica_path: str,
         sync_paths: List[str],
         ignore_dirs: List[str],
+        ignore_paths: List[str] = [],
         force: bool = False,
+        pull: bool = False,
         repeat_watch: bool = False,
     ) -> List[str]:
-        cmd_s = (
-            f"unison {replica_path}"
-            f" 'ssh://{self.instance.username}@{ip}/{replica_path}'"
-            f" -prefer {replica_path} -batch -sshargs '-i {self.ssh_key_path}'"
-        )
+        remote_replica = f"ssh://{self.instance.username}@{ip}/{replica_path}"
+        # Built as a list rather than split from a string, paths come from the
+        # local tree (priority batches) and may contain spaces or quotes
+        cmd = [
+            "unison",
+            replica_path,
+            remote_replica,
+            "-prefer",
+            replica_path,
+            "-batch",
+            "-sshargs",
+            f"-i {self.ssh_key_path}",
+        ]
 
         for sync_path in sync_paths:
-            cmd_s += f" -path {sync_path}"
-        
+            cmd += ["-path", sync_path]
+
         for ignore_dir in ignore_dirs:
-            cmd_s += f" -ignore 'Name {{,.*,*,*/,.*/}}{ignore_dir}{{.*,*,*/,.*/}}'"
+            cmd += ["-ignore", f"Name {{,.*,*,*/,.*/}}{ignore_dir}{{.*,*,*/,.*/}}"]
+
+        for ignore_path in ignore_paths:
+            cmd += ["-ignore", f"Path {ignore_path}"]
 
         if force:
-            cmd_s += f" -force {replica_path}"
+            cmd += ["-force", replica_path]
+        if pull:
+            cmd += ["-force", remote_replica]
         if repeat_watch:
-            cmd_s += " -repeat watch"
+            cmd += ["-repeat", "watch"]
 
-        return shlex.split(cmd_s.replace("\n", ""))
+        return cmd
+
+    @property
+    def _sync_manifest_path(self) -> str:
+        return os.path.join(
+            PERRY_STATE_DIR, f"{self.project_code}-sync-manifest.json"
+        )
+
+    def build_sync_queue(self) -> SyncQueue:
+        """Queue the local files that changed since the last successful push"""
+        queue = SyncQueue(
+            hot_paths=self.hot_paths,
+            recent_window=self.sync_recent_window,
+            small_file_size=self.sync_small_file_size,
+        )
+        last_pushed = load_manifest(self._sync_manifest_path)
+
+        for path, size, mtime in scan_sync_paths(
+            sync_dir=self.sync_dir,
+            sync_paths=self.sync_paths,
+            ignore_dirs=self.ignore_dirs,
+            ignore_paths=self.lazy_paths,
+        ):
+            queue.snapshot[path] = [size, mtime]
+            if last_pushed.get(path) != [size, mtime]:
+                queue.put(path, size, mtime)
+        return queue
+
+    def _push_priority_batches(
+        self, ip: str, queue: SyncQueue, popen: Optional[Popen] = None
+    ):
+        """
+        Push hot and recently modified files in small batches ahead of the
+        full push, so interactive edits don't wait behind a bulk transfer
+        """
+        while True:
+            batch = queue.pop_batch(
+                self.sync_priority_batch_size, max_tier=TIER_RECENT
+            )
+            if not batch:
+                break
+
+            logger.info(
+                "Pushing %s priority files (%s still queued)", len(batch), queue.depth
+            )
+            _run_child(
+                self._get_unison_cmd(
+                    ip=ip,
+                    replica_path=self.sync_dir,
+                    sync_paths=[item.path for item in batch],
+                    ignore_dirs=self.ignore_dirs,
+                    force=True,
+                ),
+                popen,
+            )
+            queue.complete(batch)
+
+    def _log_sync_queue_stats(self, queue: SyncQueue):
+        for path, wait in sorted(queue.wait_times.items(), key=lambda kv: kv[1]):
+            logger.debug("Synced %s after waiting %.2fs", path, wait)
+
+        stats = queue.stats()
+        logger.info(
+            "Sync queue: %s transferred, %s pending, wait mean=%.2fs max=%.2fs",
+            stats["completed"],
+            stats["depth"],
+            stats["mean_wait"],
+            stats["max_wait"],
+        )
 
     def sync(self):
         ip = self.get_ip()
+        self.sync_push(ip=ip, queue=self.build_sync_queue())
+        self.sync_watch(ip=ip)
+
+    def sync_push(self, *, ip: str, queue: SyncQueue, popen: Optional[Popen] = None):
+        logger.info("Sync queue depth: %s changed files", queue.depth)
 
         logger.info("Ensuring remote directories exist")
         ssh_cmd_s = (
@@ -203,16 +431,23 @@ class RemoteDockerClient:
         )
         ssh_cmd_s += f" -p {self.sync_dir}"
         
-        self.ssh_run(ssh_cmd=ssh_cmd_s)
+        self.ssh_run(ssh_cmd=ssh_cmd_s, ip=ip)
 
         logger.info("deleting any files owned by root (this messes with unison)")
 
         clean_cmd = (
             f"find {self.sync_dir} -user root | xargs sudo rm -rf  | echo 'no files to delete'"
         )
-        self.ssh_run(ssh_cmd=clean_cmd)
+        self.ssh_run(ssh_cmd=clean_cmd, ip=ip)
+
+        if self.lazy_paths:
+            logger.info("Indexing lazy paths, fetch them with `perry fetch`")
+            self.index_lazy_paths(ip=ip)
+
+        # First push hot and recently edited files, then the local replica's
+        # remaining contents to remote
+        self._push_priority_batches(ip, queue, popen)
 
-        # First push the local replica's contents to remote
         logger.info("Pushing local files to remote server")
         
         push_cmd = self._get_unison_cmd(
@@ -220,28 +455,136 @@ class RemoteDockerClient:
             replica_path=self.sync_dir,
             sync_paths=self.sync_paths,
             ignore_dirs=self.ignore_dirs,
+            ignore_paths=self.lazy_paths,
             force=True,
         )
 
         logger.info(f"Running push command: {push_cmd}")
         
-        subprocess.run(
-            push_cmd,
-            check=True,
-        )
+        _run_child(push_cmd, popen)
+        queue.complete(queue.drain())
+        self._log_sync_queue_stats(queue)
+        save_manifest(self._sync_manifest_path, queue.snapshot)
 
-        # Then watch for update
+    def sync_watch(
+        self,
+        *,
+        ip: str,
+        replace_process: bool = True,
+        popen: Optional[Popen] = None,
+    ):
         logger.info("Watching local and remote filesystems for changes")
         watch_cmd = self._get_unison_cmd(
             ip=ip,
             replica_path=self.sync_dir,
             ignore_dirs=self.ignore_dirs,
+            ignore_paths=self.lazy_paths,
             sync_paths=self.sync_paths,
             repeat_watch=True,
         )
 
         logger.info(f"Running watch command: {watch_cmd}")
-        os.execvp(watch_cmd[0], watch_cmd)
+        if replace_process:
+            os.execvp(watch_cmd[0], watch_cmd)
+        else:
+            _run_child(watch_cmd, popen)
+
+    def _lazy_index_path(self, lazy_path: str) -> str:
+        return os.path.join(self.sync_dir, lazy_path, LAZY_INDEX_FILENAME)
+
+    def index_lazy_paths(self, *, ip: str = None) -> Dict[str, List[Dict]]:
+        """
+        List the remote contents of every lazy path and write a local
+        placeholder index (path, size and mtime of each file) into the
+        local directory, without transferring any of the files.
+        """
+        indexes = {}
+        ip = ip or self.get_ip()
+
+        for lazy_path in self.lazy_paths:
+            remote_path = os.path.join(self.sync_dir, lazy_path)
+            output = self.instance.ssh_output(
+                ssh_key_path=self.ssh_key_path,
+                ip=ip,
+                ssh_cmd=(
+                    f"\"find {remote_path} -type f -printf '%s %T@ %P\\n'"
+                    " 2>/dev/null || true\""
+                ),
+            )
+
+            files = []
+            for line in output.splitlines():
+                size, mtime, path = line.split(" ", 2)
+                if path == LAZY_INDEX_FILENAME:
+                    continue
+                files.append(dict(path=path, size=int(size), mtime=float(mtime)))
+
+            index_path = self._lazy_index_path(lazy_path)
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path, "w") as fh:
+                json.dump(
+                    dict(path=lazy_path, indexed_at=time.time(), files=files),
+                    fh,
+                    indent=2,
+                )
+
+            logger.debug("Indexed %s remote files under %s", len(files), lazy_path)
+            indexes[lazy_path] = files
+
+        return indexes
+
+    def read_lazy_index(self) -> Dict[str, List[Dict]]:
+        indexes = {}
+
+        for lazy_path in self.lazy_paths:
+            try:
+                with open(self._lazy_index_path(lazy_path)) as fh:
+                    indexes[lazy_path] = json.load(fh)["files"]
+            except FileNotFoundError:
+                indexes[lazy_path] = []
+
+        return indexes
+
+    def _get_lazy_relative_path(self, path: str) -> str:
+        relative_path = os.path.relpath(
+            os.path.abspath(os.path.expanduser(path)), self.sync_dir
+        )
+
+        for lazy_path in self.lazy_paths:
+            if relative_path == lazy_path or relative_path.startswith(
+                lazy_path + os.sep
+            ):
+                return relative_path
+
+        raise RemoteDockerException(
+            f"{path} is not inside any of the configured lazy_paths"
+        )
+
+    def fetch(self, paths: List[str] = None):
+        """
+        Pull the given lazy paths (or all of them) from the remote instance,
+        overwriting the local copies
+        """
+        if paths:
+            fetch_paths = [self._get_lazy_relative_path(path) for path in paths]
+        else:
+            fetch_paths = self.lazy_paths
+
+        if not fetch_paths:
+            logger.warning("No lazy_paths configured, nothing to fetch")
+            return
+
+        ip = self.get_ip()
+        fetch_cmd = self._get_unison_cmd(
+            ip=ip,
+            replica_path=self.sync_dir,
+            sync_paths=fetch_paths,
+            ignore_dirs=self.ignore_dirs + [LAZY_INDEX_FILENAME],
+            pull=True,
+        )
+
+        logger.info(f"Running fetch command: {fetch_cmd}")
+        subprocess.run(fetch_cmd, check=True)
 
 
 def create_remote_docker_client(
@@ -0,0 +1,114 @@
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from yaml import safe_load
+
+from .config import PerryConfig
+from .core import RemoteDockerClient, create_remote_docker_client
+from .exceptions import RemoteDockerException
+from .util import logger
+
+AGENT_LABEL = "perry.agent"
+
+
+def _get_service_agent(service: Dict) -> str:
+    labels = service.get("labels") or {}
+    if isinstance(labels, list):
+        labels = dict(label.split("=", 1) for label in labels if "=" in label)
+    return labels.get(AGENT_LABEL)
+
+
+class Fleet:
+    """
+    The agents defined under `agents` in the perry config, each with its own
+    instance, docker context and socket. Lifecycle operations are fanned out
+    to all agents concurrently.
+    """
+
+    def __init__(
+        self, clients: Dict[str, RemoteDockerClient], *, max_workers: int
+    ):
+        if not clients:
+            raise RemoteDockerException("No agents are defined in the perry config")
+        self.clients = clients
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_config(cls, config: PerryConfig):
+        return cls(
+            {
+                agent_name: create_remote_docker_client(agent_config)
+                for agent_name, agent_config in config.agent_configs.items()
+            },
+            max_workers=config.fleet_max_workers,
+        )
+
+    def run(
+        self, operation: Callable[[str, RemoteDockerClient], Any]
+    ) -> Dict[str, Any]:
+        """
+        Run `operation(agent_name, client)` against every agent, returning the
+        result (or the raised exception) of each agent by name
+        """
+
+        def run_one(agent_name: str):
+            try:
+                return operation(agent_name, self.clients[agent_name])
+            except Exception as e:
+                logger.error("%s failed: %s", agent_name, e)
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(self.clients, executor.map(run_one, self.clients)))
+
+    def get_services_by_agent(self, compose_file: str) -> Dict[str, List[str]]:
+        with open(compose_file) as fh:
+            services = safe_load(fh).get("services", {})
+
+        services_by_agent = {agent_name: [] for agent_name in self.clients}
+        for service_name, service in services.items():
+            agent_name = _get_service_agent(service or {})
+            if agent_name is None:
+                logger.warning(
+                    "%s has no %s label, not starting it", service_name, AGENT_LABEL
+                )
+            elif agent_name not in services_by_agent:
+                raise RemoteDockerException(
+                    f"{service_name} is pinned to unknown agent {agent_name}"
+                )
+            else:
+                services_by_agent[agent_name].append(service_name)
+
+        return services_by_agent
+
+    def compose_up(self, compose_file: str, *, extra_args: List[str] = ()):
+        """Start each compose service on the agent its label pins it to"""
+        services_by_agent = self.get_services_by_agent(compose_file)
+
+        def up(agent_name: str, client: RemoteDockerClient):
+            services = services_by_agent[agent_name]
+            if not services:
+                return "no services"
+
+            client.create_remote_context()
+            cmd = [
+                "docker",
+                "--context",
+                client.project_code,
+                "compose",
+                "-f",
+                compose_file,
+                "up",
+                "-d",
+                # depends_on may name a service pinned to another agent, which
+                # would otherwise be started here as well
+                "--no-deps",
+                *extra_args,
+                *services,
+            ]
+            logger.info("Running on %s: %s", agent_name, cmd)
+            subprocess.run(cmd, check=True)
+            return services
+
+        return self.run(up)
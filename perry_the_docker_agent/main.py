@@ -1,13 +1,33 @@
-from typing import Annotated, Optional
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Annotated, Any, Dict, List, Optional
 
 import typer
 from rich import print
+from rich.console import Console
+from rich.live import Live
+from rich.table import Table
 from yaml import safe_load
 
+from .advisor import load_samples, recommend, summarize
 from .config import PerryConfig
+from .constants import PERRY_STATE_DIR
 from .core import RemoteDockerClient, create_remote_docker_client
+from .exceptions import RemoteDockerException
+from .fleet import Fleet
+from .orchestrator import UpOrchestrator
+from .providers import bulk_instance_action, find_perry_instances
+from .telemetry import render_sample
+from .util import keep_sudo_alive
 
 app = typer.Typer()
+fleet_app = typer.Typer(help="Run commands against every agent of the fleet")
+app.add_typer(fleet_app, name="fleet")
 
 
 @app.command()
@@ -25,19 +45,220 @@ def create(ctx: typer.Context):
     client.use_remote_context()
 
 
+AllOption = Annotated[
+    bool, typer.Option("--all", help="all perry agents of every project")
+]
+RegionsOption = Annotated[
+    Optional[List[str]],
+    typer.Option(
+        "--region", help="regions to search with --all, defaults to aws_region"
+    ),
+]
+
+
+def _find_all_instances(ctx: typer.Context, regions: Optional[List[str]]):
+    config: PerryConfig = ctx.meta["perry_config"]
+    return find_perry_instances(
+        regions=regions or [config.aws_region],
+        profile_name=config.credentials_profile_name,
+    )
+
+
+def _print_instances(instances: List[Dict], states: Dict[str, str] = None):
+    table = Table("region", "service", "instance", "type", "state", "ip")
+    for instance in instances:
+        table.add_row(
+            instance["region"],
+            instance["service"],
+            instance["instance_id"],
+            instance["instance_type"],
+            (states or {}).get(instance["instance_id"], instance["state"]),
+            instance["ip"] or "",
+        )
+    print(table)
+
+
+def _bulk_action(ctx: typer.Context, regions: Optional[List[str]], action: str):
+    config: PerryConfig = ctx.meta["perry_config"]
+    # Only instances that can make the transition, anything mid-way through
+    # another one (eg: stopping) would fail the whole request
+    actionable_states = ("stopped",) if action == "start" else ("pending", "running")
+    instances = [
+        instance
+        for instance in _find_all_instances(ctx, regions)
+        if instance["state"] in actionable_states
+    ]
+    states = bulk_instance_action(
+        instances, action=action, profile_name=config.credentials_profile_name
+    )
+    _print_instances(instances, states)
+
+
 @app.command()
-def start(ctx: typer.Context):
+def status(ctx: typer.Context, all_: AllOption = False, region: RegionsOption = None):
+    """Show the state of the remote agent instance"""
+    if all_:
+        _print_instances(_find_all_instances(ctx, region))
+        return
+
+    client: RemoteDockerClient = ctx.obj
+    print(client.get_instance_state())
+
+
+@app.command()
+def start(ctx: typer.Context, all_: AllOption = False, region: RegionsOption = None):
     """Start the remote agent instance"""
+    if all_:
+        _bulk_action(ctx, region, "start")
+        return
+
     client: RemoteDockerClient = ctx.obj
     print(client.start_instance())
     client.use_remote_context()
 
 
+@contextmanager
+def _redirect_output_to(log_path: str):
+    """
+    Send everything written to stdout and stderr, including by child processes
+    such as ssh and unison, to `log_path`, yielding a handle on the terminal
+    """
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout, saved_stderr = os.dup(1), os.dup(2)
+
+    with open(log_path, "a") as log, os.fdopen(os.dup(1), "w") as terminal:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            yield terminal
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_stdout, 1)
+            os.dup2(saved_stderr, 2)
+            os.close(saved_stdout)
+            os.close(saved_stderr)
+
+
 @app.command()
-def sync(ctx: typer.Context):
+def up(ctx: typer.Context):
+    """
+    Start the instance, tunnel and sync together, supervising them
+    in this process
+    """
+    client: RemoteDockerClient = ctx.obj
+    orchestrator = UpOrchestrator(client)
+    log_path = os.path.join(PERRY_STATE_DIR, f"{client.project_code}-up.log")
+
+    # The tunnel needs sudo, ask for the password now rather than over the
+    # status table, and keep the credentials fresh while the stages run
+    subprocess.run(["sudo", "-v"], check=True)
+    keep_sudo_alive()
+
+    def render() -> Table:
+        table = Table(
+            "stage", "state", "elapsed", "detail", caption=f"output in {log_path}"
+        )
+        for name, status in orchestrator.status().items():
+            elapsed = status["elapsed"]
+            table.add_row(
+                name,
+                status["state"],
+                "" if elapsed is None else f"{elapsed:.1f}s",
+                status["detail"],
+            )
+        return table
+
+    try:
+        with _redirect_output_to(log_path) as terminal:
+            orchestrator.start()
+            console = Console(file=terminal)
+            with Live(render(), console=console, auto_refresh=False) as live:
+                # The tunnel and sync run until interrupted, a failed stage
+                # brings the others down with it
+                while not (orchestrator.finished or orchestrator.stopping):
+                    if orchestrator.failed:
+                        orchestrator.stop()
+                    live.update(render(), refresh=True)
+                    time.sleep(0.5)
+                live.update(render(), refresh=True)
+    except KeyboardInterrupt:
+        return
+    finally:
+        orchestrator.stop()
+
+    for stage in orchestrator.failed:
+        print(f"[red]{stage.name} failed: {stage.error}[/red]")
+    if orchestrator.failed:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def sync(
+    ctx: typer.Context,
+    show_queue: Annotated[
+        bool, typer.Option(help="show the pending sync queue without syncing")
+    ] = False,
+):
     """Sync the given directories with the remote instance"""
     client: RemoteDockerClient = ctx.obj
-    client.sync()
+
+    if not show_queue:
+        client.sync()
+        return
+
+    queue = client.build_sync_queue()
+    table = Table("tier", "path", "size", "modified")
+    for item in queue.peek_all():
+        table.add_row(
+            str(item.tier),
+            item.path,
+            str(item.size),
+            datetime.fromtimestamp(item.mtime).isoformat(sep=" ", timespec="seconds"),
+        )
+    print(table)
+    print(f"queue depth: {queue.depth}")
+
+
+@app.command()
+def fetch(
+    ctx: typer.Context,
+    paths: Annotated[
+        Optional[List[str]],
+        typer.Argument(help="lazy paths to pull, defaults to all of them"),
+    ] = None,
+    list_: Annotated[
+        bool, typer.Option("--list", help="show the remote index instead")
+    ] = False,
+    cached: Annotated[
+        bool,
+        typer.Option(help="with --list, show the local index without re-indexing"),
+    ] = False,
+):
+    """Pull lazy paths from the remote instance on demand"""
+    client: RemoteDockerClient = ctx.obj
+
+    if not list_:
+        client.fetch(paths)
+        return
+
+    # Generated files keep appearing after `perry sync` wrote the index,
+    # so list the remote contents again unless asked not to
+    indexes = client.read_lazy_index() if cached else client.index_lazy_paths()
+
+    table = Table("path", "size", "modified")
+    for lazy_path, files in indexes.items():
+        for file in sorted(files, key=lambda f: f["path"]):
+            table.add_row(
+                f"{lazy_path}/{file['path']}",
+                str(file["size"]),
+                datetime.fromtimestamp(file["mtime"]).isoformat(
+                    sep=" ", timespec="seconds"
+                ),
+            )
+    print(table)
 
 
 @app.command()
@@ -53,8 +274,13 @@ def ssh(
 
 
 @app.command()
-def stop(ctx: typer.Context):
+def stop(ctx: typer.Context, all_: AllOption = False, region: RegionsOption = None):
     """Stop the remote agent instance"""
+    if all_:
+        _bulk_action(ctx, region, "stop")
+        ctx.obj.use_default_context()
+        return
+
     client: RemoteDockerClient = ctx.obj
     print(client.stop_instance())
     client.use_default_context()
@@ -78,6 +304,218 @@ def tunnel(ctx: typer.Context):
     client.start_tunnel()
 
 
+@app.command()
+def forwards(ctx: typer.Context):
+    """Show the container ports currently forwarded by the tunnel"""
+    client: RemoteDockerClient = ctx.obj
+
+    table = Table("container", "ports", "source")
+    for name, port_mappings in client.local_port_forwards.items():
+        table.add_row(name, ", ".join(port_mappings), "config")
+    for entry in client.port_forward_registry.load().values():
+        table.add_row(
+            entry["name"], ", ".join(str(port) for port in entry["ports"]), "docker"
+        )
+    print(table)
+
+
+@app.command()
+def top(
+    ctx: typer.Context,
+    interval: Annotated[int, typer.Option(help="seconds between samples")] = 5,
+    record: Annotated[
+        Optional[str],
+        typer.Option(help="append every sample as a JSON line to this file"),
+    ] = None,
+):
+    """Show live CPU, memory, disk, network and container usage of the instance"""
+    client: RemoteDockerClient = ctx.obj
+
+    record_fh = open(record, "a") if record else None
+    try:
+        with Live(auto_refresh=False) as live:
+            for sample in client.stream_telemetry(interval=interval):
+                live.update(render_sample(sample), refresh=True)
+                if record_fh:
+                    record_fh.write(json.dumps(sample) + "\n")
+                    record_fh.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if record_fh:
+            record_fh.close()
+
+
+@app.command()
+def advise(
+    ctx: typer.Context,
+    samples_path: Annotated[
+        str, typer.Argument(help="samples recorded with `perry top --record`")
+    ],
+    window: Annotated[
+        Optional[float], typer.Option(help="only use the last WINDOW hours")
+    ] = None,
+    apply: Annotated[
+        bool, typer.Option(help="update the stack with the recommendation")
+    ] = False,
+):
+    """Recommend an instance type and volume size from recorded telemetry"""
+    client: RemoteDockerClient = ctx.obj
+
+    summary = summarize(load_samples(samples_path, window_hours=window))
+    recommendation = recommend(
+        summary,
+        current_type=client.instance.instance_type,
+        current_volume_size=client.instance.volume_size,
+    )
+
+    def percent(value: Optional[float]) -> str:
+        return "?" if value is None else f"{value:.0f}%"
+
+    def cost(instance_type: str, volume_size: int) -> str:
+        monthly = recommendation.monthly_cost(instance_type, volume_size)
+        return "?" if monthly is None else f"${monthly:.2f}/month"
+
+    print(
+        f"Analyzed {summary['samples']} samples over {summary['hours']:.1f} hours:"
+        f" cpu p95 {summary['cpu_p95']:.0f}%, memory p95 {summary['mem_p95']:.0f}%,"
+        f" iowait mean {summary['iowait_mean']:.0f}%"
+        + (f", gpu p95 {summary['gpu_p95']:.0f}%" if summary["has_gpu"] else "")
+    )
+
+    table = Table("", "instance type", "volume", "cpu p95", "memory p95", "cost")
+    table.add_row(
+        "current",
+        recommendation.current_type,
+        f"{recommendation.current_volume_size}GB",
+        percent(summary["cpu_p95"]),
+        percent(summary["mem_p95"]),
+        cost(recommendation.current_type, recommendation.current_volume_size),
+    )
+    table.add_row(
+        "recommended",
+        recommendation.instance_type,
+        f"{recommendation.volume_size}GB",
+        percent(recommendation.projected_cpu_p95()),
+        percent(recommendation.projected_mem_p95()),
+        cost(recommendation.instance_type, recommendation.volume_size),
+    )
+    print(table)
+    for note in recommendation.notes:
+        print(f"- {note}")
+
+    if not (
+        recommendation.changes_instance_type or recommendation.changes_volume_size
+    ):
+        print("The current instance fits the recorded load")
+        return
+
+    if not apply:
+        return
+
+    if recommendation.changes_volume_size:
+        typer.confirm(
+            "Changing the volume size replaces the instance: everything on it is"
+            " lost and the new instance is bootstrapped from scratch, continue?",
+            abort=True,
+        )
+    print(
+        client.update_instance(
+            instance_type=recommendation.instance_type,
+            volume_size=recommendation.volume_size,
+        )
+    )
+    print(
+        "Update instance_type and volume_size in your perry config to match,"
+        " otherwise the next stack update will revert them"
+    )
+
+
+def _print_fleet_results(results: Dict[str, Any]):
+    table = Table("agent", "result")
+    for agent_name, result in results.items():
+        if isinstance(result, Exception):
+            table.add_row(agent_name, f"[red]failed: {result}[/red]")
+        else:
+            table.add_row(agent_name, str(result))
+    print(table)
+
+    if any(isinstance(result, Exception) for result in results.values()):
+        raise typer.Exit(code=1)
+
+
+def _get_fleet(ctx: typer.Context) -> Fleet:
+    return Fleet.from_config(ctx.meta["perry_config"])
+
+
+@fleet_app.command("create")
+def fleet_create(ctx: typer.Context):
+    """Provision an ec2 instance for every agent"""
+
+    def create_agent(_agent_name: str, client: RemoteDockerClient):
+        client.create_instance()
+        client.create_remote_context()
+        return "created"
+
+    _print_fleet_results(_get_fleet(ctx).run(create_agent))
+
+
+@fleet_app.command("start")
+def fleet_start(ctx: typer.Context):
+    """Start every agent instance"""
+
+    def start_agent(_agent_name: str, client: RemoteDockerClient):
+        client.start_instance()
+        client.create_remote_context()
+        return client.get_instance_state()
+
+    _print_fleet_results(_get_fleet(ctx).run(start_agent))
+
+
+@fleet_app.command("stop")
+def fleet_stop(ctx: typer.Context):
+    """Stop every agent instance"""
+
+    def stop_agent(_agent_name: str, client: RemoteDockerClient):
+        client.stop_instance()
+        return client.get_instance_state()
+
+    _print_fleet_results(_get_fleet(ctx).run(stop_agent))
+
+
+@fleet_app.command("delete")
+def fleet_delete(ctx: typer.Context):
+    """Delete the ec2 instance of every agent"""
+    _print_fleet_results(
+        _get_fleet(ctx).run(lambda _agent_name, client: client.delete_instance())
+    )
+
+
+@fleet_app.command("status")
+def fleet_status(ctx: typer.Context):
+    """Show the state and docker context of every agent"""
+
+    def agent_status(_agent_name: str, client: RemoteDockerClient):
+        try:
+            state = client.get_instance_state()
+        except RemoteDockerException:
+            state = "not created"
+        return f"{state} (docker context {client.project_code})"
+
+    _print_fleet_results(_get_fleet(ctx).run(agent_status))
+
+
+@fleet_app.command("compose-up")
+def fleet_compose_up(
+    ctx: typer.Context,
+    compose_file: Annotated[
+        str, typer.Option("--file", "-f", help="compose file")
+    ] = "docker-compose.yml",
+):
+    """Start every compose service on the agent its perry.agent label pins it to"""
+    _print_fleet_results(_get_fleet(ctx).compose_up(compose_file))
+
+
 @app.callback()
 def entry(
     ctx: typer.Context,
@@ -85,9 +523,16 @@ def entry(
         "./perry_config.yml",
         help="Path of the perry config",
     ),
+    agent: Optional[str] = typer.Option(
+        None,
+        help="Name of the fleet agent to run the command against",
+    ),
 ):
     loaded_yaml = safe_load(open(config_path))
     config = PerryConfig.parse_obj(loaded_yaml)
+    ctx.meta["perry_config"] = config
+    if agent is not None:
+        config = config.for_agent(agent)
     ctx.obj = create_remote_docker_client(config)
 
 
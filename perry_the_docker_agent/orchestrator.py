@@ -0,0 +1,189 @@
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .core import RemoteDockerClient
+from .util import logger, wait_until_port_is_open
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STOPPED = "stopped"
+
+
+class Stage:
+    """A step of `perry up`, run in its own thread once its dependencies are done"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        *,
+        depends_on: List["Stage"] = (),
+    ):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+        self.state = PENDING
+        self.detail = ""
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._finished = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def wait(self) -> bool:
+        """Wait until the stage finishes, returning whether it succeeded"""
+        self._finished.wait()
+        return self.state == DONE
+
+    def cancel(self):
+        """Don't run the stage if it hasn't started, and report it as stopped"""
+        self._cancelled.set()
+
+    def set_detail(self, detail: str):
+        self.detail = detail
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def _run(self):
+        try:
+            for dependency in self.depends_on:
+                if not dependency.wait():
+                    raise RuntimeError(f"{dependency.name} failed")
+            if self._cancelled.is_set():
+                raise RuntimeError("stopped before starting")
+
+            self.state = RUNNING
+            self.started_at = time.monotonic()
+            self.result = self.func(*[d.result for d in self.depends_on])
+            self.state = DONE
+        except BaseException as e:
+            self.error = e
+            if self._cancelled.is_set():
+                logger.info("%s stopped: %s", self.name, e)
+                self.state = STOPPED
+            else:
+                logger.error("%s failed: %s", self.name, e)
+                self.state = FAILED
+        finally:
+            self.finished_at = time.monotonic()
+            self._finished.set()
+
+
+class UpOrchestrator:
+    """
+    Brings the remote agent up as concurrent stages: the docker context and
+    the local sync manifest are prepared while the instance starts, and the
+    tunnel and sync are started as soon as SSH accepts connections, so the
+    whole bring-up takes about as long as its slowest stage.
+
+    Every child process of the stages is started through `_popen`, so that
+    `stop` can terminate them when a stage fails or `perry up` exits.
+    """
+
+    def __init__(self, client: RemoteDockerClient):
+        self.client = client
+        self._processes: List[subprocess.Popen] = []
+        self._processes_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self.context = Stage("context", client.use_remote_context)
+        self.manifest = Stage("manifest", client.build_sync_queue)
+        self.instance = Stage("instance", client.start_instance)
+        self.ssh = Stage("ssh", self._wait_for_ssh, depends_on=[self.instance])
+        self.tunnel = Stage("tunnel", self._run_tunnel, depends_on=[self.ssh])
+        self.sync = Stage(
+            "sync", self._run_sync, depends_on=[self.ssh, self.manifest]
+        )
+
+    @property
+    def stages(self) -> List[Stage]:
+        return [
+            self.context,
+            self.manifest,
+            self.instance,
+            self.ssh,
+            self.tunnel,
+            self.sync,
+        ]
+
+    def _wait_for_ssh(self, _start_result) -> str:
+        ip = self.client.get_ip()
+        self.ssh.set_detail(ip)
+        wait_until_port_is_open(ip, 22, sleep_time=2, max_attempts=60)
+        return ip
+
+    def _run_tunnel(self, ip: str):
+        self.tunnel.set_detail("forwarding")
+        self.client.start_tunnel(ip=ip, popen=self._popen)
+
+    def _run_sync(self, ip: str, queue):
+        self.sync.set_detail(f"pushing {queue.depth} files")
+        self.client.sync_push(ip=ip, queue=queue, popen=self._popen)
+        self.sync.set_detail("watching")
+        self.client.sync_watch(ip=ip, replace_process=False, popen=self._popen)
+
+    def _popen(self, cmd: List[str]) -> subprocess.Popen:
+        with self._processes_lock:
+            if self._stopping.is_set():
+                raise RuntimeError("perry up is stopping")
+            process = subprocess.Popen(cmd)
+            self._processes.append(process)
+            return process
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def stop(self, timeout: float = 10):
+        """
+        Terminate the child processes of every stage and wait for them to
+        exit, killing those still running after `timeout` seconds
+        """
+        with self._processes_lock:
+            self._stopping.set()
+            processes = list(self._processes)
+
+        for stage in self.stages:
+            stage.cancel()
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    @property
+    def failed(self) -> List[Stage]:
+        return [stage for stage in self.stages if stage.state == FAILED]
+
+    @property
+    def finished(self) -> bool:
+        return all(stage.state in (DONE, FAILED, STOPPED) for stage in self.stages)
+
+    def status(self) -> Dict[str, Dict]:
+        return {
+            stage.name: dict(
+                state=stage.state, detail=stage.detail, elapsed=stage.elapsed
+            )
+            for stage in self.stages
+        }
@@ -0,0 +1,208 @@
+import json
+import os
+import subprocess
+import time
+from typing import Callable, Dict, List, Set
+
+from .util import logger
+
+DOCKER_EVENTS_CMD = (
+    "docker events --filter type=container"
+    " --filter event=start --filter event=die"
+    " --format '{{json .}}'"
+)
+
+
+class PortForwardRegistry:
+    """
+    Local record of the ports forwarded for each remote container,
+    persisted so that other processes (eg: `perry forwards`) can read it
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.forwards: Dict[str, Dict] = {}
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path) as fh:
+                self.forwards = json.load(fh)
+        except FileNotFoundError:
+            self.forwards = {}
+        return self.forwards
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as fh:
+            json.dump(self.forwards, fh, indent=2)
+
+    def add(self, container_id: str, name: str, ports: List[int]):
+        self.forwards[container_id] = dict(name=name, ports=ports)
+        self.save()
+
+    def remove(self, container_id: str) -> Dict:
+        entry = self.forwards.pop(container_id, None)
+        self.save()
+        return entry
+
+    def clear(self):
+        self.forwards = {}
+        self.save()
+
+    @property
+    def forwarded_ports(self) -> Set[int]:
+        return {port for entry in self.forwards.values() for port in entry["ports"]}
+
+
+class DockerEventPortForwarder:
+    """
+    Follows the remote docker events stream over an SSH control master and
+    adds or cancels local forwards for the published ports of containers as
+    they start and stop, leaving every other forward of the tunnel untouched.
+    """
+
+    def __init__(
+        self,
+        *,
+        ssh_prefix: List[str],
+        host: str,
+        bind_address: str,
+        static_ports: Set[int],
+        registry: PortForwardRegistry,
+    ):
+        self.ssh_prefix = ssh_prefix
+        self.host = host
+        self.bind_address = bind_address
+        self.static_ports = static_ports
+        self.registry = registry
+
+    def _remote_output(self, remote_cmd: str) -> str:
+        return subprocess.run(
+            self.ssh_prefix + [self.host, remote_cmd],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+    def _control(self, operation: str, port: int):
+        spec = f"{self.bind_address}:{port}:localhost:{port}"
+        logger.debug("Port forward %s: %s", operation, spec)
+        subprocess.run(
+            self.ssh_prefix + ["-O", operation, "-L", spec, self.host],
+            check=True,
+            capture_output=True,
+        )
+
+    def _inspect(self, container_id: str) -> Dict:
+        output = self._remote_output(
+            f"docker inspect --format '{{{{json .}}}}' {container_id}"
+        )
+        return json.loads(output)
+
+    def published_ports(self, container: Dict) -> List[int]:
+        ports = set()
+        port_bindings = container["NetworkSettings"]["Ports"] or {}
+        for port_proto, bindings in port_bindings.items():
+            if not port_proto.endswith("/tcp"):
+                continue
+            for binding in bindings or []:
+                ports.add(int(binding["HostPort"]))
+        return sorted(ports)
+
+    def add_container(self, container_id: str):
+        try:
+            container = self._inspect(container_id)
+        except subprocess.CalledProcessError:
+            logger.debug("Container %s is already gone", container_id)
+            return
+        name = container["Name"].lstrip("/")
+        taken = self.static_ports | self.registry.forwarded_ports
+
+        ports = []
+        for port in self.published_ports(container):
+            if port in taken:
+                logger.debug("Port %s of %s is already forwarded", port, name)
+                continue
+            try:
+                self._control("forward", port)
+            except subprocess.CalledProcessError as e:
+                logger.warning("Could not forward port %s of %s: %s", port, name, e)
+                continue
+            ports.append(port)
+
+        if ports:
+            logger.info("Forwarding %s for %s", ports, name)
+            self.registry.add(container_id, name, ports)
+
+    def remove_container(self, container_id: str):
+        entry = self.registry.forwards.get(container_id)
+        if entry is None:
+            return
+
+        for port in entry["ports"]:
+            try:
+                self._control("cancel", port)
+            except subprocess.CalledProcessError as e:
+                logger.warning("Could not cancel forward of port %s: %s", port, e)
+
+        logger.info("Stopped forwarding %s for %s", entry["ports"], entry["name"])
+        self.registry.remove(container_id)
+
+    def forward_running_containers(self):
+        """
+        Reconcile the forwards with the containers running right now, as
+        events may have been missed while the stream was down
+        """
+        running = set(self._remote_output("docker ps -q --no-trunc").split())
+
+        for container_id in list(self.registry.forwards):
+            if container_id not in running:
+                self.remove_container(container_id)
+        for container_id in running:
+            if container_id not in self.registry.forwards:
+                self.add_container(container_id)
+
+    def _follow_events(self):
+        events = subprocess.Popen(
+            self.ssh_prefix + [self.host, DOCKER_EVENTS_CMD],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            for line in events.stdout:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logger.debug("Skipping unexpected docker events line: %s", line)
+                    continue
+
+                action = event.get("Action", event.get("status"))
+                if action == "start":
+                    self.add_container(event["id"])
+                elif action == "die":
+                    self.remove_container(event["id"])
+        finally:
+            events.terminate()
+
+    def run(self, *, is_alive: Callable[[], bool], retry_delay: float = 5):
+        """
+        Follow the events stream for as long as `is_alive()` (the tunnel) is,
+        reconnecting when the stream ends, eg: when the remote dockerd restarts
+        """
+        self.registry.clear()
+        try:
+            while is_alive():
+                try:
+                    self.forward_running_containers()
+                    self._follow_events()
+                except subprocess.CalledProcessError as e:
+                    logger.warning("Could not reach the remote docker: %s", e)
+
+                if is_alive():
+                    logger.warning("docker events stream ended, reconnecting")
+                    time.sleep(retry_delay)
+        finally:
+            if is_alive():
+                for container_id in list(self.registry.forwards):
+                    self.remove_container(container_id)
+            self.registry.clear()
@@ -3,14 +3,17 @@ import shlex
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import platform
 
 import boto3
+from botocore.exceptions import ClientError, WaiterError
 from sceptre.context import SceptreContext
 from sceptre.plan.plan import SceptrePlan
 
+from .config import INSTANCE_SERVICE_NAME
 from .constants import (
     SCEPTRE_PATH,
 )
@@ -28,6 +31,126 @@ def _get_ec2_client(region, *, profile_name: str):
     )
 
 
+# StartInstances/StopInstances calls are split into batches of this many ids
+INSTANCE_BATCH_SIZE = 100
+ACTIVE_INSTANCE_STATES = ["pending", "running", "stopping", "stopped"]
+
+
+def _find_perry_instances_in_region(region: str, *, profile_name: str) -> List[Dict]:
+    paginator = _get_ec2_client(region, profile_name=profile_name).get_paginator(
+        "describe_instances"
+    )
+    pages = paginator.paginate(
+        Filters=[
+            dict(Name="tag:service", Values=[f"*{INSTANCE_SERVICE_NAME}*"]),
+            dict(Name="instance-state-name", Values=ACTIVE_INSTANCE_STATES),
+        ],
+        PaginationConfig=dict(PageSize=1000),
+    )
+
+    instances = []
+    for page in pages:
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                tags = {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
+                instances.append(
+                    dict(
+                        region=region,
+                        instance_id=instance["InstanceId"],
+                        service=tags["service"],
+                        state=instance["State"]["Name"],
+                        instance_type=instance["InstanceType"],
+                        ip=instance.get("PublicIpAddress"),
+                    )
+                )
+    return instances
+
+
+def find_perry_instances(*, regions: List[str], profile_name: str) -> List[Dict]:
+    """
+    Find the agents of every perry project in the given regions, with one
+    paginated describe call per region, the regions being queried concurrently
+    """
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        results = executor.map(
+            lambda region: _find_perry_instances_in_region(
+                region, profile_name=profile_name
+            ),
+            regions,
+        )
+        return sorted(
+            (instance for instances in results for instance in instances),
+            key=lambda instance: (instance["region"], instance["service"]),
+        )
+
+
+def bulk_instance_action(
+    instances: List[Dict], *, action: str, profile_name: str, wait: bool = True
+) -> Dict[str, str]:
+    """
+    Start or stop the given instances with one request per region (and batch),
+    returning the state each instance moved to
+    """
+    if action not in ("start", "stop"):
+        raise ValueError(f"Unsupported action {action}")
+
+    ids_by_region: Dict[str, List[str]] = {}
+    for instance in instances:
+        ids_by_region.setdefault(instance["region"], []).append(
+            instance["instance_id"]
+        )
+
+    states = {}
+    sent_batches = []
+    for region, instance_ids in ids_by_region.items():
+        ec2_client = _get_ec2_client(region, profile_name=profile_name)
+
+        for start in range(0, len(instance_ids), INSTANCE_BATCH_SIZE):
+            batch = instance_ids[start : start + INSTANCE_BATCH_SIZE]
+            try:
+                if action == "start":
+                    changes = ec2_client.start_instances(InstanceIds=batch)[
+                        "StartingInstances"
+                    ]
+                else:
+                    changes = ec2_client.stop_instances(InstanceIds=batch)[
+                        "StoppingInstances"
+                    ]
+            except ClientError as e:
+                # One bad batch (eg: an instance that changed state since it was
+                # listed) shouldn't leave the other batches untouched
+                logger.error("Failed to %s %s in %s: %s", action, batch, region, e)
+                for instance_id in batch:
+                    states[instance_id] = f"error: {e.response['Error']['Code']}"
+                continue
+
+            sent_batches.append((region, batch))
+            for change in changes:
+                states[change["InstanceId"]] = change["CurrentState"]["Name"]
+
+    if not wait:
+        return states
+
+    # Every request is sent before waiting, so the instances transition together
+    desired_state = "running" if action == "start" else "stopped"
+    for region, batch in sent_batches:
+        waiter = _get_ec2_client(region, profile_name=profile_name).get_waiter(
+            f"instance_{desired_state}"
+        )
+        try:
+            waiter.wait(
+                InstanceIds=batch,
+                WaiterConfig=dict(Delay=5, MaxAttempts=24),
+            )
+        except WaiterError as e:
+            logger.error("Timed out waiting for %s in %s: %s", batch, region, e)
+            continue
+        for instance_id in batch:
+            states[instance_id] = desired_state
+
+    return states
+
+
 class InstanceProvider:
     def __init__(
         self,
@@ -44,9 +167,17 @@ class InstanceProvider:
     def create_instance(self, ssh_key_path: str):
         raise NotImplementedError
 
+    def update_instance(
+        self, *, instance_type: str, volume_size: int, ssh_key_path: str
+    ):
+        raise NotImplementedError
+
     def delete_instance(self):
         raise NotImplementedError
 
+    def get_instance_state(self) -> str:
+        raise NotImplementedError
+
     def is_running(self):
         raise NotImplementedError
 
@@ -75,18 +206,32 @@ class InstanceProvider:
 
         os.execvp(cmd[0], cmd)
 
-    def ssh_run(self, *, ssh_key_path: str, ssh_cmd: str = None):
-        cmd = self._build_ssh_cmd(ssh_key_path, ssh_cmd)
+    def ssh_run(self, *, ssh_key_path: str, ssh_cmd: str = None, ip: str = None):
+        cmd = self._build_ssh_cmd(ssh_key_path, ssh_cmd, ip=ip)
         return subprocess.run(cmd, check=True)
 
-    def _build_ssh_cmd(self, ssh_key_path: str, ssh_cmd=None, options=None):
+    def ssh_output(
+        self, *, ssh_key_path: str, ssh_cmd: str = None, ip: str = None
+    ) -> str:
+        cmd = self._build_ssh_cmd(ssh_key_path, ssh_cmd, ip=ip)
+        return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+
+    def ssh_stream(self, *, ssh_key_path: str, ssh_cmd: str) -> subprocess.Popen:
+        cmd = self._build_ssh_cmd(ssh_key_path, ssh_cmd)
+        return subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+
+    def _build_ssh_cmd(self, ssh_key_path: str, ssh_cmd=None, options=None, ip=None):
         ssh_cmd = ssh_cmd if ssh_cmd else ""
         options = options if options else ""
+        # callers that already resolved the ip save two describe calls
+        ip = ip if ip else self.get_ip()
 
         cmd_s = (
             f"ssh -o StrictHostKeyChecking=no -o ServerAliveInterval=60"
             f" -i {ssh_key_path}"
-            f" {options} {self.username}@{self.get_ip()} {ssh_cmd}"
+            f" {options} {self.username}@{ip} {ssh_cmd}"
         )
 
         logger.debug(
@@ -245,7 +390,9 @@ class AWSInstanceProvider(InstanceProvider):
         if "complete" not in sceptre_result.values():
             raise Exception(f"sceptre command failed: {list(sceptre_result.values())}")
         logger.info("Stack created")
+        self._wait_and_bootstrap(ssh_key_path)
 
+    def _wait_and_bootstrap(self, ssh_key_path: str):
         while self.get_instance_state() != "running":
             logger.warning("Waiting to bootstrap: instance not yet running")
             time.sleep(5)
@@ -259,6 +406,26 @@ class AWSInstanceProvider(InstanceProvider):
         logger.info("Starting bootstrap")
         self._bootstrap_instance(ssh_key_path)
 
+    def update_instance(
+        self, *, instance_type: str, volume_size: int, ssh_key_path: str
+    ) -> Dict:
+        # VolumeSize is part of the BlockDeviceMappings, changing it makes
+        # cloudformation replace the instance with a blank one
+        replaces_instance = int(volume_size) != int(self.volume_size)
+
+        self.instance_type = instance_type
+        self.volume_size = volume_size
+        result = self._get_sceptre_plan().update()
+
+        logger.debug("Got sceptre result: %s", result)
+        if "complete" not in result.values():
+            raise Exception(f"sceptre command failed: {list(result.values())}")
+
+        if replaces_instance:
+            logger.warning("The instance was replaced, bootstrapping the new one")
+            self._wait_and_bootstrap(ssh_key_path)
+        return result
+
     def delete_instance(self) -> Dict:
         result = self._get_sceptre_plan().delete()
 
@@ -271,7 +438,32 @@ class AWSInstanceProvider(InstanceProvider):
     def _bootstrap_instance(self, ssh_key_path: str):
         logger.info("Bootstrapping instance, will take a few minutes")
 
-        self.ssh_connect(ssh_key_path=ssh_key_path, ssh_cmd=self.bootstrap_command)
+        # Run as a child rather than replacing the process so that several
+        # agents can be created at once
+        result = subprocess.run(
+            self._build_ssh_cmd(ssh_key_path, self.bootstrap_command)
+        )
+
+        # Bootstrap commands copied from earlier defaults end with the reboot,
+        # whose dropped connection ssh reports as 255
+        if self.bootstrap_command.strip().endswith("sudo reboot"):
+            if result.returncode not in (0, 255):
+                raise RemoteDockerException(
+                    f"Bootstrap failed with exit code {result.returncode}"
+                )
+            return
+
+        if result.returncode != 0:
+            raise RemoteDockerException(
+                f"Bootstrap failed with exit code {result.returncode}"
+            )
+
+        # The reboot drops the connection, which ssh reports as 255
+        result = subprocess.run(self._build_ssh_cmd(ssh_key_path, "sudo reboot"))
+        if result.returncode not in (0, 255):
+            raise RemoteDockerException(
+                f"Reboot after bootstrap failed with exit code {result.returncode}"
+            )
 
     def create_keypair(self, ssh_key_path) -> Dict:
         # shell=True with `ssh-keygen` doesn't seem to be passing path correctly
@@ -0,0 +1,180 @@
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# Lower tiers are transferred first
+TIER_HOT = 0
+TIER_RECENT_SMALL = 1
+TIER_RECENT = 2
+TIER_BULK = 3
+
+
+class SyncItem:
+    def __init__(
+        self, *, path: str, size: int, mtime: float, tier: int, enqueued_at: float
+    ):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.tier = tier
+        self.enqueued_at = enqueued_at
+
+    def __repr__(self):
+        return f"SyncItem(path={self.path!r}, tier={self.tier}, size={self.size})"
+
+
+class SyncQueue:
+    """
+    Priority queue of pending file transfers.
+
+    Only files that changed since the last push are queued. Recently modified
+    files under a hot path come first, then other recently modified small
+    files, then other recent files and finally everything else. Within a tier
+    the most recently modified (and then smallest) files win, so the file that
+    was just saved in the editor is never stuck behind a bulk of generated
+    output.
+    """
+
+    def __init__(
+        self,
+        *,
+        hot_paths: List[str],
+        recent_window: float,
+        small_file_size: int,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.hot_paths = hot_paths
+        self.recent_window = recent_window
+        self.small_file_size = small_file_size
+        self.clock = clock
+        self._heap: List[Tuple] = []
+        self._counter = itertools.count()
+        self.wait_times: Dict[str, float] = {}
+        # (size, mtime) of every scanned file, saved once the push succeeds
+        self.snapshot: Dict[str, List] = {}
+
+    def _is_hot(self, path: str) -> bool:
+        return any(
+            path == hot_path or path.startswith(hot_path + os.sep)
+            for hot_path in self.hot_paths
+        )
+
+    def get_tier(self, path: str, size: int, mtime: float) -> int:
+        if self.clock() - mtime > self.recent_window:
+            return TIER_BULK
+
+        if self._is_hot(path):
+            return TIER_HOT
+        if size <= self.small_file_size:
+            return TIER_RECENT_SMALL
+        return TIER_RECENT
+
+    def put(self, path: str, size: int, mtime: float) -> SyncItem:
+        item = SyncItem(
+            path=path,
+            size=size,
+            mtime=mtime,
+            tier=self.get_tier(path, size, mtime),
+            enqueued_at=self.clock(),
+        )
+        heapq.heappush(
+            self._heap, (item.tier, -item.mtime, item.size, next(self._counter), item)
+        )
+        return item
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+
+    def peek_all(self) -> List[SyncItem]:
+        return [entry[-1] for entry in sorted(self._heap)]
+
+    def pop_batch(self, max_items: int, max_tier: int = TIER_BULK) -> List[SyncItem]:
+        batch = []
+        while (
+            self._heap and len(batch) < max_items and self._heap[0][0] <= max_tier
+        ):
+            batch.append(heapq.heappop(self._heap)[-1])
+        return batch
+
+    def drain(self) -> List[SyncItem]:
+        return self.pop_batch(self.depth)
+
+    def complete(self, items: List[SyncItem]):
+        now = self.clock()
+        for item in items:
+            self.wait_times[item.path] = now - item.enqueued_at
+
+    def stats(self) -> Dict:
+        waits = list(self.wait_times.values())
+        return dict(
+            depth=self.depth,
+            completed=len(waits),
+            max_wait=max(waits, default=0.0),
+            mean_wait=sum(waits) / len(waits) if waits else 0.0,
+        )
+
+
+def load_manifest(path: str) -> Dict[str, List]:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(path: str, snapshot: Dict[str, List]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fh:
+        json.dump(snapshot, fh)
+
+
+def _is_ignored(
+    relative_path: str, ignore_dirs: List[str], ignore_paths: List[str]
+) -> bool:
+    if any(part in ignore_dirs for part in relative_path.split(os.sep)):
+        return True
+    return any(
+        relative_path == ignore_path or relative_path.startswith(ignore_path + os.sep)
+        for ignore_path in ignore_paths
+    )
+
+
+def scan_sync_paths(
+    *,
+    sync_dir: str,
+    sync_paths: List[str],
+    ignore_dirs: List[str],
+    ignore_paths: List[str],
+) -> Iterator[Tuple[str, int, float]]:
+    """Yield (path relative to sync_dir, size, mtime) for every local file to sync"""
+    for sync_path in sync_paths:
+        root = os.path.join(sync_dir, sync_path)
+
+        if os.path.isfile(root):
+            stat = os.stat(root)
+            yield os.path.normpath(sync_path), stat.st_size, stat.st_mtime
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            relative_dir = os.path.relpath(dirpath, sync_dir)
+            dirnames[:] = [
+                dirname
+                for dirname in dirnames
+                if not _is_ignored(
+                    os.path.join(relative_dir, dirname), ignore_dirs, ignore_paths
+                )
+            ]
+
+            for filename in filenames:
+                relative_path = os.path.join(relative_dir, filename)
+                if _is_ignored(relative_path, ignore_dirs, ignore_paths):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                yield relative_path, stat.st_size, stat.st_mtime
@@ -0,0 +1,257 @@
+import json
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from rich.console import Group
+from rich.table import Table
+
+SAMPLE_MARKER = "@@sample"
+END_MARKER = "@@end"
+
+# Whole disks only, partitions would double count the IO
+DISK_NAME_RE = re.compile(r"^(nvme\d+n\d+|[shv]d[a-z]+|xvd[a-z]+)$")
+IGNORED_INTERFACE_PREFIXES = ("lo", "veth", "docker", "br-")
+
+
+def get_sampler_script(interval: int) -> str:
+    """
+    Shell loop run on the instance through a single SSH session, printing one
+    frame of raw host and container counters every `interval` seconds
+    """
+    return f"""
+while true; do
+    echo "{SAMPLE_MARKER} $(date +%s.%N)"
+    echo "@@nproc"; nproc
+    echo "@@loadavg"; cat /proc/loadavg
+    echo "@@stat"; head -1 /proc/stat
+    echo "@@meminfo"; grep -E '^(MemTotal|MemAvailable|SwapTotal|SwapFree):' /proc/meminfo
+    echo "@@diskstats"; cat /proc/diskstats
+    echo "@@netdev"; tail -n +3 /proc/net/dev
+    echo "@@df"; df -B1 --output=size,used / | tail -1
+    echo "@@gpu"; nvidia-smi --query-gpu=utilization.gpu,memory.used,memory.total \\
+        --format=csv,noheader,nounits 2>/dev/null
+    echo "@@containers"; docker stats --no-stream --format '{{{{json .}}}}' 2>/dev/null
+    echo "{END_MARKER}"
+    sleep {interval}
+done
+"""
+
+
+def parse_frames(lines: Iterable[str]) -> Iterator[Dict[str, List[str]]]:
+    """Group the sampler output into frames of section name -> lines"""
+    frame = None
+    section = None
+
+    for line in lines:
+        line = line.rstrip("\n")
+
+        if line.startswith(SAMPLE_MARKER):
+            frame = dict(timestamp=[line.split()[1]])
+            section = None
+        elif frame is None:
+            continue
+        elif line == END_MARKER:
+            yield frame
+            frame = None
+        elif line.startswith("@@"):
+            section = line[2:]
+            frame[section] = []
+        elif section is not None:
+            frame[section].append(line)
+
+
+def _parse_cpu(lines: List[str]) -> Dict[str, int]:
+    fields = [int(value) for value in lines[0].split()[1:9]]
+    user, nice, system, idle, iowait, irq, softirq, steal = fields
+    return dict(total=sum(fields), idle=idle, iowait=iowait, steal=steal)
+
+
+def _parse_meminfo(lines: List[str]) -> Dict[str, int]:
+    # values are in kB
+    return {
+        line.split(":")[0]: int(line.split()[1]) * 1024 for line in lines if line
+    }
+
+
+def _parse_diskstats(lines: List[str]) -> Dict[str, int]:
+    read = written = 0
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 10 or not DISK_NAME_RE.match(parts[2]):
+            continue
+        # sectors are always 512 bytes in /proc/diskstats
+        read += int(parts[5]) * 512
+        written += int(parts[9]) * 512
+    return dict(read=read, written=written)
+
+
+def _parse_netdev(lines: List[str]) -> Dict[str, int]:
+    rx = tx = 0
+    for line in lines:
+        if ":" not in line:
+            continue
+        interface, counters = line.split(":", 1)
+        if interface.strip().startswith(IGNORED_INTERFACE_PREFIXES):
+            continue
+        counters = counters.split()
+        rx += int(counters[0])
+        tx += int(counters[8])
+    return dict(rx=rx, tx=tx)
+
+
+def _parse_gpus(lines: List[str]) -> List[Dict]:
+    gpus = []
+    for line in lines:
+        values = [value.strip() for value in line.split(",")]
+        if len(values) != 3:
+            continue
+        utilization, memory_used, memory_total = (float(v) for v in values)
+        gpus.append(
+            dict(
+                utilization_percent=utilization,
+                mem_used_percent=100 * memory_used / memory_total
+                if memory_total
+                else 0.0,
+            )
+        )
+    return gpus
+
+
+def _parse_percent(value: str) -> float:
+    try:
+        return float(value.rstrip("%"))
+    except ValueError:
+        return 0.0
+
+
+def _parse_containers(lines: List[str]) -> List[Dict]:
+    containers = []
+    for line in lines:
+        try:
+            stats = json.loads(line)
+        except ValueError:
+            continue
+        containers.append(
+            dict(
+                name=stats["Name"],
+                cpu_percent=_parse_percent(stats["CPUPerc"]),
+                mem_percent=_parse_percent(stats["MemPerc"]),
+                mem_usage=stats["MemUsage"],
+                net_io=stats["NetIO"],
+                block_io=stats["BlockIO"],
+            )
+        )
+    return containers
+
+
+class TelemetrySampler:
+    """
+    Turns raw frames into samples; rates are computed from the counters of
+    the previous frame, so the first frame only primes the sampler.
+    """
+
+    def __init__(self):
+        self._previous: Optional[Dict] = None
+
+    def sample(self, frame: Dict[str, List[str]]) -> Optional[Dict]:
+        counters = dict(
+            timestamp=float(frame["timestamp"][0]),
+            cpu=_parse_cpu(frame["stat"]),
+            disk=_parse_diskstats(frame["diskstats"]),
+            net=_parse_netdev(frame["netdev"]),
+        )
+        previous, self._previous = self._previous, counters
+        if previous is None:
+            return None
+
+        elapsed = counters["timestamp"] - previous["timestamp"] or 1.0
+        cpu_total = counters["cpu"]["total"] - previous["cpu"]["total"] or 1
+
+        def cpu_percent(field: str) -> float:
+            return 100 * (counters["cpu"][field] - previous["cpu"][field]) / cpu_total
+
+        def rate(group: str, field: str) -> float:
+            return (counters[group][field] - previous[group][field]) / elapsed
+
+        meminfo = _parse_meminfo(frame["meminfo"])
+        disk_size, disk_used = (int(value) for value in frame["df"][0].split())
+        swap_total = meminfo.get("SwapTotal", 0)
+
+        return dict(
+            timestamp=counters["timestamp"],
+            vcpus=int(frame["nproc"][0]),
+            load1=float(frame["loadavg"][0].split()[0]),
+            cpu_percent=100 - cpu_percent("idle") - cpu_percent("iowait"),
+            iowait_percent=cpu_percent("iowait"),
+            steal_percent=cpu_percent("steal"),
+            mem_total=meminfo["MemTotal"],
+            mem_used_percent=100
+            * (meminfo["MemTotal"] - meminfo["MemAvailable"])
+            / meminfo["MemTotal"],
+            swap_used_percent=100
+            * (swap_total - meminfo.get("SwapFree", 0))
+            / swap_total
+            if swap_total
+            else 0.0,
+            disk_read_bps=rate("disk", "read"),
+            disk_write_bps=rate("disk", "written"),
+            disk_size=disk_size,
+            disk_used=disk_used,
+            net_rx_bps=rate("net", "rx"),
+            net_tx_bps=rate("net", "tx"),
+            gpus=_parse_gpus(frame.get("gpu", [])),
+            containers=_parse_containers(frame.get("containers", [])),
+        )
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TiB"
+
+
+def render_sample(sample: Dict) -> Group:
+    host = Table("metric", "value", title="host")
+    host.add_row("cpu", f"{sample['cpu_percent']:.1f}% of {sample['vcpus']} vcpus")
+    host.add_row("load (1m)", f"{sample['load1']:.2f}")
+    host.add_row("iowait", f"{sample['iowait_percent']:.1f}%")
+    host.add_row("steal", f"{sample['steal_percent']:.1f}%")
+    host.add_row(
+        "memory",
+        f"{sample['mem_used_percent']:.1f}% of {_format_bytes(sample['mem_total'])}",
+    )
+    host.add_row("swap", f"{sample['swap_used_percent']:.1f}%")
+    host.add_row(
+        "disk io",
+        f"read {_format_bytes(sample['disk_read_bps'])}/s"
+        f" write {_format_bytes(sample['disk_write_bps'])}/s",
+    )
+    host.add_row(
+        "disk usage",
+        f"{_format_bytes(sample['disk_used'])} of {_format_bytes(sample['disk_size'])}",
+    )
+    host.add_row(
+        "network",
+        f"rx {_format_bytes(sample['net_rx_bps'])}/s"
+        f" tx {_format_bytes(sample['net_tx_bps'])}/s",
+    )
+    for index, gpu in enumerate(sample["gpus"]):
+        host.add_row(
+            f"gpu {index}",
+            f"{gpu['utilization_percent']:.0f}%"
+            f" (memory {gpu['mem_used_percent']:.0f}%)",
+        )
+
+    containers = Table("container", "cpu", "memory", "net io", "block io")
+    for container in sorted(sample["containers"], key=lambda c: -c["cpu_percent"]):
+        containers.add_row(
+            container["name"],
+            f"{container['cpu_percent']:.1f}%",
+            f"{container['mem_usage']} ({container['mem_percent']:.1f}%)",
+            container["net_io"],
+            container["block_io"],
+        )
+
+    return Group(host, containers)
@@ -1,7 +1,10 @@
 import logging
 import os
 import socket
+import subprocess
+import threading
 import time
+from typing import Callable
 
 import colorlog
 
@@ -29,3 +32,21 @@ def wait_until_port_is_open(ip, port, sleep_time=3, max_attempts=10):
         if attempts >= max_attempts:
             raise RuntimeError(f"{ip}:{port} has not opened")
         time.sleep(sleep_time)
+
+
+def keep_sudo_alive(
+    is_alive: Callable[[], bool] = lambda: True, interval: float = 60
+) -> threading.Thread:
+    """
+    Refresh the cached sudo credentials every `interval` seconds while
+    `is_alive()`, so that background sudo calls never stop at a password prompt
+    """
+
+    def refresh():
+        while is_alive():
+            time.sleep(interval)
+            subprocess.run(["sudo", "-n", "-v"], check=False)
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    return thread
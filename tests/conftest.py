@@ -0,0 +1,149 @@
+import json
+import os
+import time
+
+import boto3
+import pytest
+from moto import mock_cloudformation, mock_ec2
+
+from perry_the_docker_agent import core, providers
+from perry_the_docker_agent.config import PerryConfig
+from perry_the_docker_agent.core import RemoteDockerClient
+from perry_the_docker_agent.util import wait_until_port_is_open
+
+from .harness import (
+    ApiRecorder,
+    Benchmark,
+    CommandRecorder,
+    SimulatedClock,
+    SshdStandIn,
+)
+
+# Injected per AWS call / per state transition, in simulated seconds
+API_LATENCY = float(os.environ.get("PERRY_BENCH_API_LATENCY", "0.05"))
+START_DELAY = float(os.environ.get("PERRY_BENCH_START_DELAY", "30"))
+STOP_DELAY = float(os.environ.get("PERRY_BENCH_STOP_DELAY", "20"))
+
+BENCHMARK_RESULTS = []
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USER", "bench")
+    monkeypatch.setattr(core, "PERRY_STATE_DIR", str(tmp_path / ".perry"))
+
+    aws_dir = tmp_path / ".aws"
+    aws_dir.mkdir()
+    (aws_dir / "credentials").write_text(
+        "[default]\naws_access_key_id = testing\naws_secret_access_key = testing\n"
+    )
+    (aws_dir / "config").write_text("[default]\nregion = us-east-1\n")
+    monkeypatch.setenv("AWS_SHARED_CREDENTIALS_FILE", str(aws_dir / "credentials"))
+    monkeypatch.setenv("AWS_CONFIG_FILE", str(aws_dir / "config"))
+    return tmp_path
+
+
+@pytest.fixture
+def mocked_aws(home):
+    providers._get_ec2_client.cache_clear()
+    with mock_ec2(), mock_cloudformation():
+        yield
+    providers._get_ec2_client.cache_clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimulatedClock()
+    monkeypatch.setattr(time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def api_recorder(mocked_aws, clock, monkeypatch):
+    recorder = ApiRecorder(
+        clock, latency=API_LATENCY, start_delay=START_DELAY, stop_delay=STOP_DELAY
+    )
+    recorder.install(monkeypatch)
+    return recorder
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    recorder = CommandRecorder()
+    recorder.install(monkeypatch)
+    return recorder
+
+
+@pytest.fixture
+def sshd(monkeypatch):
+    stand_in = SshdStandIn()
+    monkeypatch.setattr(
+        providers,
+        "wait_until_port_is_open",
+        lambda _ip, _port, **kwargs: wait_until_port_is_open(
+            "127.0.0.1", stand_in.port, **kwargs
+        ),
+    )
+    yield stand_in
+    stand_in.close()
+
+
+@pytest.fixture
+def benchmark(clock, api_recorder):
+    benchmark = Benchmark(clock, api_recorder)
+    yield benchmark
+    BENCHMARK_RESULTS.extend(benchmark.results)
+
+
+@pytest.fixture
+def config(home, mocked_aws) -> PerryConfig:
+    project_dir = home / "project"
+    project_dir.mkdir()
+    for index in range(20):
+        (project_dir / f"module_{index}.py").write_text("print('hello')\n")
+
+    ec2 = boto3.client("ec2", region_name="us-east-1")
+    image_id = ec2.describe_images(Owners=["amazon"])["Images"][0]["ImageId"]
+
+    config = PerryConfig(
+        project_id="bench",
+        aws_region="us-east-1",
+        instance_ami=image_id,
+        sync_paths=[str(project_dir)],
+        key_path=str(home / ".ssh" / "id_rsa_bench"),
+        local_port_forwards={"api": {"8080": "8080"}},
+    )
+    ec2.create_key_pair(KeyName=config.key_pair_name)
+    return config
+
+
+@pytest.fixture
+def client(config, sshd, commands) -> RemoteDockerClient:
+    return RemoteDockerClient.from_config(config)
+
+
+@pytest.fixture
+def created_client(client, api_recorder) -> RemoteDockerClient:
+    client.create_instance()
+    return client
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not BENCHMARK_RESULTS:
+        return
+
+    terminalreporter.section("perry lifecycle benchmarks")
+    terminalreporter.write_line(
+        f"{'command':<24}{'wall (s)':>10}{'simulated (s)':>15}{'api calls':>11}"
+    )
+    for result in BENCHMARK_RESULTS:
+        terminalreporter.write_line(
+            f"{result.name:<24}{result.wall_time:>10.3f}"
+            f"{result.simulated_time:>15.1f}{sum(result.api_calls.values()):>11}"
+        )
+
+    output_path = os.environ.get("PERRY_BENCH_OUTPUT")
+    if output_path:
+        with open(output_path, "w") as fh:
+            json.dump([result.as_dict() for result in BENCHMARK_RESULTS], fh, indent=2)
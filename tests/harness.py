@@ -0,0 +1,178 @@
+"""
+Offline harness to measure the perry lifecycle commands.
+
+EC2 and CloudFormation are served by moto, while every AWS call goes through
+`ApiRecorder`, which counts calls per operation, adds an injectable latency
+and holds instances in `pending`/`stopping` for a configurable time after a
+start or stop. Sleeps advance a `SimulatedClock` instead of blocking, so the
+time a user would spend waiting is reported without the test waiting for it.
+"""
+import socket
+import subprocess
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+from botocore.client import BaseClient
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self.now += seconds
+
+    def time(self) -> float:
+        return self.now
+
+
+class ApiRecorder:
+    def __init__(
+        self,
+        clock: SimulatedClock,
+        *,
+        latency: float = 0.0,
+        start_delay: float = 0.0,
+        stop_delay: float = 0.0,
+    ):
+        self.clock = clock
+        self.latency = latency
+        self.start_delay = start_delay
+        self.stop_delay = stop_delay
+        self.calls: Counter = Counter()
+        self._transitions: Dict[str, tuple] = {}
+        self._original_make_api_call = BaseClient._make_api_call
+
+    def install(self, monkeypatch):
+        recorder = self
+
+        def _make_api_call(client, operation_name, api_params):
+            return recorder._call(client, operation_name, api_params)
+
+        monkeypatch.setattr(BaseClient, "_make_api_call", _make_api_call)
+
+    def _call(self, client, operation_name: str, api_params: Dict):
+        service = client.meta.service_model.service_name
+        self.calls[f"{service}.{operation_name}"] += 1
+        self.clock.sleep(self.latency)
+
+        response = self._original_make_api_call(client, operation_name, api_params)
+
+        if service != "ec2":
+            return response
+        if operation_name == "StartInstances":
+            self._record_transition(api_params, "pending", self.start_delay)
+        elif operation_name == "StopInstances":
+            self._record_transition(api_params, "stopping", self.stop_delay)
+        elif operation_name == "DescribeInstances":
+            self._apply_transitions(response)
+        return response
+
+    def _record_transition(self, api_params: Dict, state: str, delay: float):
+        for instance_id in api_params["InstanceIds"]:
+            self._transitions[instance_id] = (state, self.clock.time() + delay)
+
+    def _apply_transitions(self, response: Dict):
+        for reservation in response["Reservations"]:
+            for instance in reservation["Instances"]:
+                state, until = self._transitions.get(
+                    instance["InstanceId"], (None, 0.0)
+                )
+                if state is not None and self.clock.time() < until:
+                    instance["State"] = dict(Name=state, Code=0)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class CommandRecorder:
+    """Stands in for ssh, unison and docker, recording the command lines"""
+
+    def __init__(self, stdout: str = "", returncode: int = 0):
+        self.commands: List[List[str]] = []
+        self.stdout = stdout
+        self.returncode = returncode
+
+    def run(self, cmd, *args, **kwargs):
+        self.commands.append(list(cmd) if not isinstance(cmd, str) else [cmd])
+        return subprocess.CompletedProcess(
+            cmd, self.returncode, stdout=self.stdout, stderr=""
+        )
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(subprocess, "run", self.run)
+
+
+class SshdStandIn:
+    """A local listener that accepts connections like sshd on port 22 would"""
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen()
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            connection.close()
+
+    def close(self):
+        self._socket.close()
+
+
+class BenchmarkResult:
+    def __init__(
+        self,
+        name: str,
+        *,
+        wall_time: float,
+        simulated_time: float,
+        api_calls: Counter,
+    ):
+        self.name = name
+        self.wall_time = wall_time
+        self.simulated_time = simulated_time
+        self.api_calls = api_calls
+
+    def as_dict(self) -> Dict:
+        return dict(
+            name=self.name,
+            wall_time=round(self.wall_time, 4),
+            simulated_time=round(self.simulated_time, 2),
+            api_calls=dict(self.api_calls),
+            total_api_calls=sum(self.api_calls.values()),
+        )
+
+
+class Benchmark:
+    def __init__(self, clock: SimulatedClock, recorder: ApiRecorder):
+        self.clock = clock
+        self.recorder = recorder
+        self.results: List[BenchmarkResult] = []
+
+    def measure(self, name: str, func, *args, **kwargs) -> BenchmarkResult:
+        calls_before = Counter(self.recorder.calls)
+        simulated_before = self.clock.time()
+        wall_before = time.perf_counter()
+
+        func(*args, **kwargs)
+
+        result = BenchmarkResult(
+            name,
+            wall_time=time.perf_counter() - wall_before,
+            simulated_time=self.clock.time() - simulated_before,
+            api_calls=self.recorder.calls - calls_before,
+        )
+        self.results.append(result)
+        return result
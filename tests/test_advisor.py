@@ -0,0 +1,93 @@
+import json
+
+from perry_the_docker_agent.advisor import (
+    GIB,
+    load_samples,
+    percentile,
+    recommend,
+    summarize,
+)
+
+
+def _sample(timestamp, *, cpu=10.0, mem=40.0, gpu=None, disk_used=10 * GIB):
+    return dict(
+        timestamp=timestamp,
+        vcpus=4,
+        load1=0.1,
+        cpu_percent=cpu,
+        iowait_percent=0.0,
+        steal_percent=0.0,
+        mem_total=16 * GIB,
+        mem_used_percent=mem,
+        swap_used_percent=0.0,
+        disk_read_bps=0.0,
+        disk_write_bps=0.0,
+        disk_size=200 * GIB,
+        disk_used=disk_used,
+        net_rx_bps=0.0,
+        net_tx_bps=0.0,
+        gpus=[]
+        if gpu is None
+        else [dict(utilization_percent=gpu, mem_used_percent=0.0)],
+        containers=[],
+    )
+
+
+def test_percentile():
+    assert percentile([], 95) == 0.0
+    assert percentile(list(range(1, 101)), 95) == 95
+
+
+def test_load_samples_window(tmp_path):
+    path = tmp_path / "samples.jsonl"
+    path.write_text(
+        "\n".join(json.dumps(_sample(hour * 3600)) for hour in range(10))
+    )
+
+    assert len(load_samples(str(path))) == 10
+    assert len(load_samples(str(path), window_hours=2)) == 3
+
+
+def test_idle_gpu_instance_is_downsized():
+    summary = summarize([_sample(t, cpu=20, mem=30, gpu=0) for t in range(10)])
+
+    recommendation = recommend(
+        summary, current_type="g4dn.xlarge", current_volume_size=200
+    )
+
+    assert recommendation.instance_type == "t3.large"
+    assert recommendation.projected_cpu_p95() == 40
+    assert recommendation.monthly_cost(
+        recommendation.instance_type, 200
+    ) < recommendation.monthly_cost("g4dn.xlarge", 200)
+
+
+def test_saturated_instance_is_upsized():
+    summary = summarize([_sample(t, cpu=95, mem=90) for t in range(10)])
+
+    recommendation = recommend(
+        summary, current_type="t3.xlarge", current_volume_size=200
+    )
+
+    assert recommendation.instance_type == "t3.2xlarge"
+    assert not recommendation.changes_volume_size
+
+
+def test_fitting_instance_is_kept():
+    summary = summarize([_sample(t, cpu=50, mem=60) for t in range(10)])
+
+    recommendation = recommend(
+        summary, current_type="t3.xlarge", current_volume_size=30
+    )
+
+    assert not recommendation.changes_instance_type
+
+
+def test_full_volume_is_grown():
+    summary = summarize([_sample(t, disk_used=180 * GIB) for t in range(10)])
+
+    recommendation = recommend(
+        summary, current_type="t3.xlarge", current_volume_size=200
+    )
+
+    assert recommendation.volume_size == 300
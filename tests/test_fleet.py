@@ -0,0 +1,107 @@
+import pytest
+
+from perry_the_docker_agent.config import AgentConfig, PerryConfig
+from perry_the_docker_agent.exceptions import RemoteDockerException
+from perry_the_docker_agent.fleet import Fleet
+
+
+@pytest.fixture
+def fleet_config(tmp_path, monkeypatch) -> PerryConfig:
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USER", "bench")
+    return PerryConfig(
+        project_id="bench",
+        sync_paths=[str(tmp_path / "project")],
+        local_port_forwards={"api": {"8080": "8080"}},
+        agents={
+            "gpu": dict(instance_type="g4dn.xlarge"),
+            "cpu": dict(local_port_forwards={"db": {"5432": "5432"}}),
+        },
+    )
+
+
+def test_for_agent_naming(fleet_config, tmp_path):
+    gpu = fleet_config.for_agent("gpu")
+
+    assert fleet_config.project_code == "benchs-bench-perry"
+    assert gpu.project_code == "benchs-bench-perry-gpu"
+    assert gpu.instance_service_name == "benchs-bench-perry-ec2-agent-gpu"
+    assert gpu.key_pair_name == fleet_config.key_pair_name
+    # agents share the project's key
+    assert gpu.non_null_key_path == fleet_config.non_null_key_path
+    assert gpu.non_null_key_path == str(tmp_path / ".ssh" / "id_rsa_benchs_bench_perry")
+
+
+def test_for_agent_overrides(fleet_config):
+    gpu = fleet_config.for_agent("gpu")
+    cpu = fleet_config.for_agent("cpu")
+
+    assert gpu.instance_type == "g4dn.xlarge"
+    assert cpu.instance_type == fleet_config.instance_type
+    assert gpu.agents == {}
+
+    # the project's local forwards are not bound by every agent's tunnel
+    assert gpu.local_port_forwards == {}
+    assert cpu.local_port_forwards == {"db": {"5432": "5432"}}
+
+
+def test_for_unknown_agent(fleet_config):
+    with pytest.raises(RemoteDockerException, match="No agent named web"):
+        fleet_config.for_agent("web")
+
+
+def test_agent_configs_reject_shared_local_ports(fleet_config):
+    assert set(fleet_config.agent_configs) == {"gpu", "cpu"}
+
+    config = fleet_config.copy(
+        update=dict(
+            agents={
+                **fleet_config.agents,
+                "gpu": AgentConfig(
+                    local_port_forwards={"postgres": {"5432": "5432"}}
+                ),
+            }
+        )
+    )
+    with pytest.raises(RemoteDockerException, match="Local port 5432"):
+        config.agent_configs
+
+
+def test_get_services_by_agent(tmp_path):
+    compose_file = tmp_path / "docker-compose.yml"
+    compose_file.write_text(
+        """
+services:
+  trainer:
+    image: trainer
+    labels:
+      perry.agent: gpu
+  api:
+    image: api
+    labels:
+      - perry.agent=cpu
+      - other=label
+  db:
+    image: postgres
+    labels: ["perry.agent=cpu"]
+  docs:
+    image: docs
+"""
+    )
+    fleet = Fleet({"gpu": object(), "cpu": object()}, max_workers=2)
+
+    assert fleet.get_services_by_agent(str(compose_file)) == {
+        "gpu": ["trainer"],
+        "cpu": ["api", "db"],
+    }
+
+
+def test_get_services_by_unknown_agent(tmp_path):
+    compose_file = tmp_path / "docker-compose.yml"
+    compose_file.write_text(
+        "services:\n  web:\n    labels:\n      perry.agent: arm\n"
+    )
+    fleet = Fleet({"gpu": object()}, max_workers=1)
+
+    with pytest.raises(RemoteDockerException, match="unknown agent arm"):
+        fleet.get_services_by_agent(str(compose_file))
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from perry_the_docker_agent.core import LAZY_INDEX_FILENAME, RemoteDockerClient
+from perry_the_docker_agent.exceptions import RemoteDockerException
+
+IP = "203.0.113.10"
+
+
+@pytest.fixture
+def lazy_client(config, home, commands, monkeypatch) -> RemoteDockerClient:
+    (home / "project" / "data").mkdir()
+    client = RemoteDockerClient.from_config(
+        config.copy(update=dict(lazy_paths=[str(home / "project" / "data")]))
+    )
+    monkeypatch.setattr(client.instance, "get_ip", lambda: IP)
+    return client
+
+
+def _unison_cmds(commands):
+    return [cmd for cmd in commands.commands if cmd[0] == "unison"]
+
+
+def _has_args(cmd, *args) -> bool:
+    return any(
+        cmd[index : index + len(args)] == list(args) for index in range(len(cmd))
+    )
+
+
+def test_index_lazy_paths(lazy_client, home, commands):
+    commands.stdout = (
+        "12 1700000000.5 train.csv\n"
+        "3 1700000001.0 sub dir/file with spaces.txt\n"
+        f"5 1700000002.0 {LAZY_INDEX_FILENAME}\n"
+    )
+
+    indexes = lazy_client.index_lazy_paths(ip=IP)
+
+    ssh_cmd = " ".join(commands.commands[-1])
+    assert ssh_cmd.startswith("ssh")
+    assert f"ubuntu@{IP}" in ssh_cmd
+    assert f"find {home}/project/data -type f -printf" in ssh_cmd
+
+    # the index itself is skipped and paths keep their spaces
+    assert indexes == {
+        "project/data": [
+            dict(path="train.csv", size=12, mtime=1700000000.5),
+            dict(path="sub dir/file with spaces.txt", size=3, mtime=1700000001.0),
+        ]
+    }
+    with open(home / "project" / "data" / LAZY_INDEX_FILENAME) as fh:
+        assert json.load(fh)["files"] == indexes["project/data"]
+    assert lazy_client.read_lazy_index() == indexes
+
+
+def test_read_lazy_index_without_index(lazy_client):
+    assert lazy_client.read_lazy_index() == {"project/data": []}
+
+
+def test_get_lazy_relative_path(lazy_client, home):
+    assert (
+        lazy_client._get_lazy_relative_path(str(home / "project" / "data" / "a.csv"))
+        == "project/data/a.csv"
+    )
+    assert lazy_client._get_lazy_relative_path(str(home / "project" / "data")) == (
+        "project/data"
+    )
+
+    with pytest.raises(RemoteDockerException, match="not inside any"):
+        lazy_client._get_lazy_relative_path(str(home / "project" / "module_0.py"))
+    # a sibling sharing the prefix is not inside the lazy path
+    with pytest.raises(RemoteDockerException, match="not inside any"):
+        lazy_client._get_lazy_relative_path(str(home / "project" / "data2"))
+
+
+def test_push_and_watch_ignore_lazy_paths(lazy_client, commands):
+    lazy_client.sync_push(ip=IP, queue=lazy_client.build_sync_queue())
+    lazy_client.sync_watch(ip=IP, replace_process=False)
+
+    push_cmd, watch_cmd = _unison_cmds(commands)[-2:]
+    for cmd in (push_cmd, watch_cmd):
+        assert _has_args(cmd, "-ignore", "Path project/data")
+        assert _has_args(cmd, "-path", "project")
+    assert "-repeat" in watch_cmd
+
+    # lazy paths are indexed, not transferred, during the push
+    assert any("-printf" in " ".join(cmd) for cmd in commands.commands)
+
+
+def test_fetch(lazy_client, home, commands):
+    lazy_client.fetch([str(home / "project" / "data" / "train.csv")])
+
+    (fetch_cmd,) = _unison_cmds(commands)
+    assert _has_args(fetch_cmd, "-path", "project/data/train.csv")
+    assert _has_args(fetch_cmd, "-force", f"ssh://ubuntu@{IP}/{home}")
+    assert not _has_args(fetch_cmd, "-ignore", "Path project/data")
+
+
+def test_fetch_all_lazy_paths(lazy_client, commands):
+    lazy_client.fetch()
+
+    (fetch_cmd,) = _unison_cmds(commands)
+    assert _has_args(fetch_cmd, "-path", "project/data")
+
+
+def test_fetch_outside_lazy_paths(lazy_client, home, commands):
+    with pytest.raises(RemoteDockerException):
+        lazy_client.fetch([str(home / "project" / "module_0.py")])
+    assert not _unison_cmds(commands)
@@ -0,0 +1,130 @@
+import pytest
+
+from perry_the_docker_agent.core import RemoteDockerClient
+from perry_the_docker_agent.exceptions import RemoteDockerException
+from perry_the_docker_agent.providers import (
+    bulk_instance_action,
+    find_perry_instances,
+)
+
+from .conftest import START_DELAY, STOP_DELAY
+
+
+def test_create(client, api_recorder, benchmark, commands):
+    result = benchmark.measure("create", client.create_instance)
+
+    assert client.get_instance_state() == "running"
+    assert result.api_calls["ec2.DescribeInstances"] > 0
+    assert result.api_calls["cloudformation.CreateStack"] == 1
+    bootstrap_cmd, reboot_cmd = commands.commands[-2:]
+    assert bootstrap_cmd[0] == "ssh"
+    assert "sudo reboot" not in " ".join(bootstrap_cmd)
+    assert reboot_cmd[0] == "ssh"
+    assert " ".join(reboot_cmd).endswith("sudo reboot")
+
+
+def test_create_with_a_bootstrap_that_reboots(config, sshd, commands, api_recorder):
+    # as copied from the defaults of earlier versions
+    client = RemoteDockerClient.from_config(
+        config.copy(
+            update=dict(bootstrap_command=config.bootstrap_command + " && sudo reboot")
+        )
+    )
+    commands.returncode = 255
+
+    client.create_instance()
+
+    ssh_cmds = [cmd for cmd in commands.commands if cmd[0] == "ssh"]
+    assert len(ssh_cmds) == 1
+    assert " ".join(ssh_cmds[0]).endswith("sudo reboot")
+
+
+def test_create_fails_when_the_bootstrap_fails(client, api_recorder, commands):
+    commands.returncode = 255
+
+    with pytest.raises(RemoteDockerException, match="exit code 255"):
+        client.create_instance()
+
+
+def test_stop_and_start(created_client, benchmark):
+    stop = benchmark.measure("stop", created_client.stop_instance)
+    assert created_client.get_instance_state() == "stopped"
+    assert stop.simulated_time >= STOP_DELAY
+    assert stop.api_calls["ec2.StopInstances"] == 1
+
+    start = benchmark.measure("start", created_client.start_instance)
+    assert created_client.get_instance_state() == "running"
+    assert start.simulated_time >= START_DELAY
+    assert start.api_calls["ec2.StartInstances"] == 1
+
+
+def test_sync_setup(created_client, benchmark, commands):
+    ip = created_client.get_ip()
+    queue = created_client.build_sync_queue()
+    assert queue.depth == 20
+
+    commands.commands.clear()
+    result = benchmark.measure(
+        "sync setup", created_client.sync_push, ip=ip, queue=queue
+    )
+
+    unison_cmds = [cmd for cmd in commands.commands if cmd[0] == "unison"]
+    # one priority batch of recently written files, then the full push
+    assert len(unison_cmds) == 2
+    assert all(f"ssh://ubuntu@{ip}/" in " ".join(cmd) for cmd in unison_cmds)
+    assert queue.stats()["completed"] == 20
+    # the IP is passed through rather than looked up again
+    assert result.api_calls["ec2.DescribeInstances"] == 0
+
+    # nothing changed locally since the push, so nothing is pending
+    assert created_client.build_sync_queue().depth == 0
+
+
+def test_sync_paths_with_spaces_and_quotes(created_client, home, commands):
+    for name in ("my file.py", "it's.py"):
+        (home / "project" / name).write_text("print('hello')\n")
+    ip = created_client.get_ip()
+
+    commands.commands.clear()
+    created_client.sync_push(ip=ip, queue=created_client.build_sync_queue())
+
+    priority_cmd = next(cmd for cmd in commands.commands if cmd[0] == "unison")
+    paths = [
+        priority_cmd[index + 1]
+        for index, arg in enumerate(priority_cmd)
+        if arg == "-path"
+    ]
+    assert "project/my file.py" in paths
+    assert "project/it's.py" in paths
+    # the only positional arguments are the two replicas
+    assert priority_cmd[1:3] == [str(home), f"ssh://ubuntu@{ip}/{home}"]
+
+
+def test_tunnel_command(created_client, benchmark, commands):
+    ip = created_client.get_ip()
+
+    benchmark.measure("tunnel command", created_client._get_tunnel_cmd, ip=ip)
+    result = benchmark.measure("tunnel", created_client.start_tunnel)
+
+    tunnel_cmd = " ".join(commands.commands[-1])
+    assert tunnel_cmd.startswith("sudo ssh")
+    assert f"ubuntu@{ip}" in tunnel_cmd
+    assert "-L localhost:8080:localhost:8080" in tunnel_cmd
+    assert result.api_calls["ec2.DescribeInstances"] > 0
+
+
+def test_bulk_stop(created_client, benchmark):
+    instances = find_perry_instances(regions=["us-east-1"], profile_name="default")
+    assert [instance["service"] for instance in instances] == [
+        created_client.instance.instance_service_name
+    ]
+
+    result = benchmark.measure(
+        "stop --all",
+        bulk_instance_action,
+        instances,
+        action="stop",
+        profile_name="default",
+    )
+    assert created_client.get_instance_state() == "stopped"
+    assert result.api_calls["ec2.StopInstances"] == 1
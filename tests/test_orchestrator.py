@@ -0,0 +1,164 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from perry_the_docker_agent import orchestrator as orchestrator_module
+from perry_the_docker_agent.orchestrator import (
+    DONE,
+    FAILED,
+    RUNNING,
+    STOPPED,
+    Stage,
+    UpOrchestrator,
+)
+
+# stands in for a long running child such as the tunnel or unison watch
+LONG_RUNNING_CMD = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+
+def _wait_for(predicate, timeout=10):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError("Timed out waiting for the condition")
+
+
+def test_stage_runs_after_its_dependencies():
+    order = []
+    release = threading.Event()
+
+    def first():
+        release.wait(5)
+        order.append("first")
+        return "ip"
+
+    def second(first_result):
+        order.append(f"second got {first_result}")
+
+    stage_1 = Stage("first", first)
+    stage_2 = Stage("second", second, depends_on=[stage_1])
+    stage_2.start()
+    stage_1.start()
+
+    assert stage_2.state != RUNNING
+    release.set()
+    assert stage_2.wait()
+    assert order == ["first", "second got ip"]
+    assert stage_1.state == stage_2.state == DONE
+
+
+def test_stage_failure_propagates_to_dependents():
+    calls = []
+
+    def broken():
+        raise RuntimeError("no route to host")
+
+    stage_1 = Stage("ssh", broken)
+    stage_2 = Stage("tunnel", calls.append, depends_on=[stage_1])
+    stage_3 = Stage("sync", calls.append, depends_on=[stage_2])
+    for stage in (stage_3, stage_2, stage_1):
+        stage.start()
+
+    assert not stage_3.wait()
+    assert calls == []
+    assert [stage.state for stage in (stage_1, stage_2, stage_3)] == [FAILED] * 3
+    assert str(stage_1.error) == "no route to host"
+    assert str(stage_2.error) == "ssh failed"
+    assert str(stage_3.error) == "tunnel failed"
+
+
+def test_cancelled_stage_does_not_run():
+    calls = []
+    stage = Stage("sync", lambda: calls.append("ran"))
+    stage.cancel()
+    stage.start()
+
+    assert not stage.wait()
+    assert stage.state == STOPPED
+    assert calls == []
+
+
+class FakeClient:
+    """Runs a long lived tunnel child and fails or keeps syncing on demand"""
+
+    def __init__(self, *, sync_fails: bool):
+        self.sync_fails = sync_fails
+        self.children = []
+
+    def use_remote_context(self):
+        pass
+
+    def build_sync_queue(self):
+        return type("Queue", (), {"depth": 0})()
+
+    def start_instance(self):
+        return "running"
+
+    def get_ip(self):
+        return "203.0.113.10"
+
+    def _run(self, popen):
+        child = popen(LONG_RUNNING_CMD)
+        self.children.append(child)
+        returncode = child.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, LONG_RUNNING_CMD)
+
+    def start_tunnel(self, *, ip, popen):
+        self._run(popen)
+
+    def sync_push(self, *, ip, queue, popen):
+        # let the tunnel child start first
+        _wait_for(lambda: self.children)
+        if self.sync_fails:
+            raise subprocess.CalledProcessError(1, ["unison"])
+
+    def sync_watch(self, *, ip, replace_process, popen):
+        self._run(popen)
+
+
+@pytest.fixture(autouse=True)
+def ssh_is_open(monkeypatch):
+    monkeypatch.setattr(
+        orchestrator_module, "wait_until_port_is_open", lambda *args, **kwargs: None
+    )
+
+
+def test_failed_stage_tears_down_the_others():
+    client = FakeClient(sync_fails=True)
+    orchestrator = UpOrchestrator(client)
+    orchestrator.start()
+
+    _wait_for(lambda: orchestrator.failed)
+    (tunnel_child,) = client.children
+    assert tunnel_child.poll() is None
+
+    orchestrator.stop()
+
+    assert tunnel_child.poll() is not None
+    _wait_for(lambda: orchestrator.finished)
+    assert orchestrator.sync.state == FAILED
+    assert orchestrator.tunnel.state == STOPPED
+    assert orchestrator.failed == [orchestrator.sync]
+
+
+def test_stop_terminates_every_child():
+    client = FakeClient(sync_fails=False)
+    orchestrator = UpOrchestrator(client)
+    orchestrator.start()
+
+    _wait_for(lambda: len(client.children) == 2)
+    assert not orchestrator.failed
+
+    orchestrator.stop()
+
+    assert all(child.poll() is not None for child in client.children)
+    _wait_for(lambda: orchestrator.finished)
+    assert orchestrator.tunnel.state == orchestrator.sync.state == STOPPED
+    # nothing new is started once stopping
+    with pytest.raises(RuntimeError):
+        orchestrator._popen(LONG_RUNNING_CMD)
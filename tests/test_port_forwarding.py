@@ -0,0 +1,172 @@
+import json
+import subprocess
+from typing import Dict, List
+
+import pytest
+
+from perry_the_docker_agent.port_forwarding import (
+    DockerEventPortForwarder,
+    PortForwardRegistry,
+)
+
+SSH_PREFIX = ["sudo", "-n", "ssh", "-S", "/var/run/bench.ctl"]
+HOST = "ubuntu@203.0.113.10"
+
+
+def _container(name: str, ports: Dict[str, List[str]]) -> Dict:
+    return {
+        "Name": f"/{name}",
+        "NetworkSettings": {
+            "Ports": {
+                port_proto: [{"HostIp": "0.0.0.0", "HostPort": port} for port in ports]
+                for port_proto, ports in ports.items()
+            }
+        },
+    }
+
+
+class FakeRemote:
+    """Answers the forwarder's ssh calls from a table of remote containers"""
+
+    def __init__(self):
+        self.containers: Dict[str, Dict] = {}
+        self.events: List[str] = []
+        self.controls: List[tuple] = []
+
+    def run(self, cmd, *args, **kwargs):
+        assert cmd[: len(SSH_PREFIX)] == SSH_PREFIX
+        if "-O" in cmd:
+            operation = cmd[cmd.index("-O") + 1]
+            port = int(cmd[cmd.index("-L") + 1].split(":")[1])
+            self.controls.append((operation, port))
+            return subprocess.CompletedProcess(cmd, 0, stdout="", stderr="")
+
+        remote_cmd = cmd[-1]
+        if remote_cmd.startswith("docker ps"):
+            stdout = "\n".join(self.containers) + "\n"
+        elif remote_cmd.startswith("docker inspect"):
+            container_id = remote_cmd.split()[-1]
+            if container_id not in self.containers:
+                raise subprocess.CalledProcessError(1, cmd)
+            stdout = json.dumps(self.containers[container_id])
+        else:
+            raise AssertionError(f"Unexpected command {cmd}")
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr="")
+
+    def popen(self, cmd, *args, **kwargs):
+        assert cmd[-1].startswith("docker events")
+        return FakeEventsProcess(self.events)
+
+
+class FakeEventsProcess:
+    def __init__(self, lines: List[str]):
+        self.stdout = iter(lines)
+
+    def terminate(self):
+        pass
+
+
+@pytest.fixture
+def remote(monkeypatch) -> FakeRemote:
+    remote = FakeRemote()
+    monkeypatch.setattr(subprocess, "run", remote.run)
+    monkeypatch.setattr(subprocess, "Popen", remote.popen)
+    return remote
+
+
+@pytest.fixture
+def forwarder(tmp_path, remote) -> DockerEventPortForwarder:
+    return DockerEventPortForwarder(
+        ssh_prefix=SSH_PREFIX,
+        host=HOST,
+        bind_address="localhost",
+        static_ports={8080},
+        registry=PortForwardRegistry(str(tmp_path / "forwards.json")),
+    )
+
+
+def _event(action: str, container_id: str) -> str:
+    return json.dumps({"Type": "container", "Action": action, "id": container_id})
+
+
+def test_published_ports(forwarder):
+    container = _container(
+        "web", {"80/tcp": ["8000", "8001"], "53/udp": ["5353"], "443/tcp": []}
+    )
+    assert forwarder.published_ports(container) == [8000, 8001]
+    assert forwarder.published_ports({"NetworkSettings": {"Ports": None}}) == []
+
+
+def test_add_container_skips_static_and_taken_ports(forwarder, remote):
+    remote.containers["a"] = _container("api", {"80/tcp": ["8000"], "81/tcp": ["8080"]})
+    remote.containers["b"] = _container("web", {"80/tcp": ["8000"], "81/tcp": ["9000"]})
+
+    forwarder.add_container("a")
+    forwarder.add_container("b")
+
+    # 8080 is a static forward of the tunnel and 8000 already belongs to api
+    assert remote.controls == [("forward", 8000), ("forward", 9000)]
+    assert forwarder.registry.load() == {
+        "a": dict(name="api", ports=[8000]),
+        "b": dict(name="web", ports=[9000]),
+    }
+
+
+def test_add_container_that_is_gone(forwarder, remote):
+    forwarder.add_container("missing")
+
+    assert remote.controls == []
+    assert forwarder.registry.forwards == {}
+
+
+def test_remove_container(forwarder, remote):
+    remote.containers["a"] = _container("api", {"80/tcp": ["8000", "8001"]})
+    forwarder.add_container("a")
+
+    forwarder.remove_container("a")
+    forwarder.remove_container("never-forwarded")
+
+    assert remote.controls[2:] == [("cancel", 8000), ("cancel", 8001)]
+    assert forwarder.registry.load() == {}
+
+
+def test_forward_running_containers_reconciles(forwarder, remote):
+    remote.containers["stale"] = _container("old", {"80/tcp": ["7000"]})
+    forwarder.add_container("stale")
+    del remote.containers["stale"]
+    remote.containers["new"] = _container("new", {"80/tcp": ["7001"]})
+
+    forwarder.forward_running_containers()
+
+    assert remote.controls == [("forward", 7000), ("cancel", 7000), ("forward", 7001)]
+    assert list(forwarder.registry.forwards) == ["new"]
+
+
+def test_follow_events(forwarder, remote):
+    remote.containers["a"] = _container("api", {"80/tcp": ["8000"]})
+    remote.events = [
+        "not json\n",
+        _event("start", "a") + "\n",
+        json.dumps({"Type": "container", "Action": "exec_start", "id": "a"}) + "\n",
+        _event("die", "a") + "\n",
+    ]
+
+    forwarder._follow_events()
+
+    assert remote.controls == [("forward", 8000), ("cancel", 8000)]
+    assert forwarder.registry.forwards == {}
+
+
+def test_run_reconnects_and_cancels_on_exit(forwarder, remote, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda _seconds: None)
+    remote.containers["a"] = _container("api", {"80/tcp": ["8000"]})
+    # is_alive answers for: connect, reconnect, connect again, no reconnect,
+    # leave the loop and, in cleanup, a tunnel that is still up
+    alive = iter([True, True, True, False, False, True])
+
+    forwarder.run(is_alive=lambda: next(alive), retry_delay=0)
+
+    # forwarded on the first connection, left alone on the reconnect and
+    # cancelled on exit
+    assert remote.controls == [("forward", 8000), ("cancel", 8000)]
+    assert forwarder.registry.load() == {}
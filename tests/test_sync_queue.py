@@ -0,0 +1,83 @@
+from perry_the_docker_agent.sync_queue import (
+    TIER_BULK,
+    TIER_HOT,
+    TIER_RECENT,
+    TIER_RECENT_SMALL,
+    SyncQueue,
+    scan_sync_paths,
+)
+
+
+def _queue(now=1000.0):
+    return SyncQueue(
+        hot_paths=["project/src"],
+        recent_window=60,
+        small_file_size=100,
+        clock=lambda: now,
+    )
+
+
+def test_tiers():
+    queue = _queue()
+
+    assert queue.get_tier("project/src/app.py", 10_000, 990) == TIER_HOT
+    # hot paths only jump the queue for recent edits
+    assert queue.get_tier("project/src/old.py", 10, 0) == TIER_BULK
+    assert queue.get_tier("project/notes.md", 10, 990) == TIER_RECENT_SMALL
+    assert queue.get_tier("project/big.bin", 10_000, 990) == TIER_RECENT
+    assert queue.get_tier("project/old.txt", 10, 0) == TIER_BULK
+
+
+def test_pop_batch_orders_by_priority():
+    queue = _queue()
+    queue.put("project/build/out.js", 50, 100)
+    queue.put("project/notes.md", 10, 980)
+    queue.put("project/just_saved.py", 10, 999)
+    queue.put("project/src/app.py", 10_000, 950)
+    queue.put("project/src/untouched.py", 10, 0)
+
+    batch = queue.pop_batch(10, max_tier=TIER_RECENT)
+
+    assert [item.path for item in batch] == [
+        "project/src/app.py",
+        "project/just_saved.py",
+        "project/notes.md",
+    ]
+    assert queue.depth == 2
+
+
+def test_stats():
+    now = [0.0]
+    queue = SyncQueue(
+        hot_paths=[], recent_window=60, small_file_size=100, clock=lambda: now[0]
+    )
+    queue.put("a", 1, 0)
+    queue.put("b", 1, 0)
+
+    now[0] = 2.0
+    queue.complete(queue.pop_batch(1))
+    now[0] = 6.0
+    queue.complete(queue.drain())
+
+    assert queue.stats() == dict(depth=0, completed=2, max_wait=6.0, mean_wait=4.0)
+
+
+def test_scan_sync_paths_skips_ignored(tmp_path):
+    project = tmp_path / "project"
+    (project / "node_modules").mkdir(parents=True)
+    (project / "coverage").mkdir()
+    (project / "app.py").write_text("x")
+    (project / "node_modules" / "dep.js").write_text("x")
+    (project / "coverage" / "index.html").write_text("x")
+
+    paths = [
+        path
+        for path, _size, _mtime in scan_sync_paths(
+            sync_dir=str(tmp_path),
+            sync_paths=["project"],
+            ignore_dirs=["node_modules"],
+            ignore_paths=["project/coverage"],
+        )
+    ]
+
+    assert paths == ["project/app.py"]
@@ -0,0 +1,54 @@
+from perry_the_docker_agent.telemetry import TelemetrySampler, parse_frames
+
+
+def _frame(timestamp, *, cpu_user, idle, iowait, sectors_read, rx_bytes):
+    return f"""noise before the first frame
+@@sample {timestamp}
+@@nproc
+4
+@@loadavg
+0.50 0.40 0.30 1/100 123
+@@stat
+cpu  {cpu_user} 0 0 {idle} {iowait} 0 0 0 0 0
+@@meminfo
+MemTotal:       16000 kB
+MemAvailable:    4000 kB
+SwapTotal:          0 kB
+SwapFree:           0 kB
+@@diskstats
+ 259 0 nvme0n1 100 0 {sectors_read} 0 0 0 0 0 0 0 0
+ 259 1 nvme0n1p1 100 0 {sectors_read} 0 0 0 0 0 0 0 0
+@@netdev
+  eth0: {rx_bytes} 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+    lo: 999 0 0 0 0 0 0 0 999 0 0 0 0 0 0 0
+@@df
+1000 250
+@@gpu
+45, 1000, 4000
+@@containers
+{{"Name":"web","CPUPerc":"12.5%","MemPerc":"3.0%","MemUsage":"10MiB / 1GiB","NetIO":"1kB / 2kB","BlockIO":"0B / 0B"}}
+@@end
+"""
+
+
+def test_sampler_computes_rates_between_frames():
+    output = _frame(
+        10.0, cpu_user=100, idle=100, iowait=0, sectors_read=0, rx_bytes=0
+    ) + _frame(
+        12.0, cpu_user=150, idle=125, iowait=25, sectors_read=8, rx_bytes=2000
+    )
+    sampler = TelemetrySampler()
+
+    samples = [sampler.sample(frame) for frame in parse_frames(output.splitlines())]
+
+    assert samples[0] is None
+    sample = samples[1]
+    assert sample["cpu_percent"] == 50
+    assert sample["iowait_percent"] == 25
+    assert sample["mem_used_percent"] == 75
+    # partitions and loopback are not double counted
+    assert sample["disk_read_bps"] == 8 * 512 / 2
+    assert sample["net_rx_bps"] == 1000
+    assert sample["gpus"] == [dict(utilization_percent=45, mem_used_percent=25)]
+    assert sample["containers"][0]["name"] == "web"
+    assert sample["containers"][0]["cpu_percent"] == 12.5